@@ -1,44 +1,240 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-  
 
-import requests
-import json
+import logging
+import logging.handlers
+import queue
+import threading
+import atexit
+import orjson
 import time
 import os
-from datetime import datetime, timedelta
-import pandas as pd
+import random
+import sys
+import argparse
+import bisect
+import gzip
+import hashlib
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 import numpy as np
 import asyncio
 import aiohttp
-from concurrent.futures import ThreadPoolExecutor
-import threading
 import urllib.parse
-from io import BytesIO
-import base64
 import pytz
 
+# 日志和消息中的时间统一使用UTC+8
+_TIMEZONE = pytz.timezone('Asia/Shanghai')
+
+logger = logging.getLogger('okx_monitor')
+
+# 交易额显示单位：按阈值分档（千/百万/十亿），每档对应换算除数和显示格式（后缀、小数位）
+_VOLUME_STEPS = (1_000, 1_000_000, 1_000_000_000)
+_VOLUME_SCALES = (1, 1_000, 1_000_000, 1_000_000_000)
+_VOLUME_FORMATS = ('{:.0f}', '{:.0f}K', '{:.0f}M', '{:.2f}B')
+# 批量格式化使用的NumPy版本
+_VOLUME_THRESHOLDS = np.array(_VOLUME_STEPS, dtype=np.float64)
+_VOLUME_DIVISORS = np.array(_VOLUME_SCALES, dtype=np.float64)
+
+# 日交易额历史：每天一条记录（交易额、当天开始时间戳/秒），日期在展示时再格式化
+_DAILY_HISTORY_DTYPE = np.dtype([('volume', 'f8'), ('ts', 'i8')])
+
+# OKX K线数据格式: [ts, o, h, l, c, vol, volCcy, volCcyQuote, confirm]，解析成矩阵后使用的列
+_KLINE_TS = 0
+_KLINE_CLOSE = 4
+_KLINE_VOL_QUOTE = 7  # volCcyQuote：以计价货币（USDT）计算的交易额
+
+# 爆量判断使用的周期数：当前周期 + 前10个周期（MA10）
+_RATIO_WINDOW = 11
+
+# 图表配色：柱状图按交易对循环使用16色，趋势图在此基础上再多4色（模块级常量，不再每次调用重建）
+_BAR_CHART_COLORS = (
+    '#FF6384', '#36A2EB', '#FFCE56', '#4BC0C0',
+    '#9966FF', '#FF9F40', '#FF6384', '#C9CBCF',
+    '#FF5733', '#33FF57', '#3357FF', '#FF33A1',
+    '#A133FF', '#33FFF5', '#F5FF33', '#FF8C33'
+)
+_TREND_CHART_COLORS = _BAR_CHART_COLORS + ('#8C33FF', '#33FF8C', '#FF3333', '#3333FF')
+
+# 消息末尾说明中固定不变的部分（阈值和图表开关相关的说明在发送时按配置补充）
+_LEGEND_HEADER = (
+    "---\n\n"
+    "**说明**:\n"
+    "- **爆量信号**: 1H需10倍增长，4H需5倍增长\n"
+)
+_LEGEND_FIELD_NOTES = (
+    "- **过亿信号**: 当天成交额超过1亿USDT\n"
+    "- **过亿信号**: 当天成交额超过1亿USDT\n"
+    "- **相比上期**: 与上一个同周期的交易额对比\n"
+    "- **相比MA10**: 与过去10个周期平均值对比\n"
+    "- **当前交易额**: 1H为最新1小时K线volCcyQuote，4H为最新4小时K线volCcyQuote\n"
+    "- **当天总额**: 24小时内所有1小时K线volCcyQuote字段之和\n"
+    "- **K/M/B**: 千/百万/十亿 USDT\n"
+)
+
+# 爆量表格的表头和行模板（列顺序一致），每行只做一次format_map
+_ALERT_TABLE_HEADER = (
+    "| 交易对 | 当前交易额 | 24H涨跌幅 | 相比上期 | 相比MA10 | 当天总额 | 昨天 | 前天 | 3天前 |\n"
+    "|--------|------------|-----------|----------|----------|----------|------|------|------|\n"
+)
+_ALERT_ROW = "| {inst_id} | {current} | {price_change} | {prev_ratio} | {ma10_ratio} | {daily} | {day1} | {day2} | {day3} |\n"
+
+
+def setup_logging():
+    """配置日志输出：格式与原来的print一致（[UTC+8时间] 消息），格式化和写stdout都在后台线程完成
+
+    扫描过程中的logger.info只是把日志记录放入队列，由QueueListener线程写出；程序退出时停止监听线程并写完剩余日志
+    """
+    formatter = logging.Formatter('[%(asctime)s] %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+    formatter.converter = lambda timestamp: datetime.fromtimestamp(timestamp, _TIMEZONE).timetuple()
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(formatter)
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.setLevel(logging.INFO)
+    listener.start()
+    atexit.register(listener.stop)
+
+
+def parse_klines(klines):
+    """将OKX K线（字符串列表）一次性转换为float64矩阵（去掉confirm列），后续计算不再逐个float()"""
+    return np.array([candle[:8] for candle in klines], dtype=np.float64).reshape(-1, 8)
+
+
+def volume_window(volumes):
+    """截取爆量判断所需的交易额窗口（当前+前10个周期），数据不足时返回全NaN，不会触发爆量
+
+    窗口用float32保存：约7位有效数字对"10倍/4倍"这类倍数判断和表格里的K/M/B显示足够，矩阵内存减半
+    """
+    window = np.full(_RATIO_WINDOW, np.nan, dtype=np.float32)
+    if len(volumes) >= _RATIO_WINDOW:
+        window[:] = volumes[:_RATIO_WINDOW]
+    return window
+
+
+def format_volume(volume):
+    """格式化交易额显示（单个数值用bisect在常量元组上查档，避免NumPy标量调用开销）"""
+    i = bisect.bisect_right(_VOLUME_STEPS, volume)
+    return _VOLUME_FORMATS[i].format(volume / _VOLUME_SCALES[i])
+
+
+def format_volume_array(volumes):
+    """批量格式化交易额，一次向量化查档，返回字符串列表"""
+    volumes = np.asarray(volumes, dtype=np.float64)
+    indexes = np.searchsorted(_VOLUME_THRESHOLDS, volumes, side='right')
+    scaled = volumes / _VOLUME_DIVISORS[indexes]
+    return [_VOLUME_FORMATS[i].format(value) for value, i in zip(scaled.tolist(), indexes.tolist())]
+
+
+def format_price_change(price_change):
+    """格式化24小时涨跌幅显示"""
+    if price_change > 0:
+        return f"📈+{price_change:.2f}%"
+    elif price_change < 0:
+        return f"📉{price_change:.2f}%"
+    return "➖0.00%"
+
+
+def rank_alerts(alerts, volume_key):
+    """按交易额从高到低排列警报（np.argsort一次排序，返回新列表，不修改原列表）"""
+    volumes = np.fromiter((alert[volume_key] for alert in alerts), dtype=np.float64, count=len(alerts))
+    # 取负后稳定排序，交易额相同时保持原有顺序
+    return [alerts[i] for i in np.argsort(-volumes, kind='stable')]
+
+
 class OKXVolumeMonitor:
     def __init__(self):
         self.base_url = "https://www.okx.com"
+        # 各接口完整地址只拼接一次，请求时直接复用
+        self.candles_url = f"{self.base_url}/api/v5/market/candles"
+        self.instruments_url = f"{self.base_url}/api/v5/public/instruments"
+        self.tickers_url = f"{self.base_url}/api/v5/market/tickers"
+        self.instruments_params = {'instType': 'SWAP'}  # 永续合约
+        # K线请求参数模板：按(bar, limit)缓存，每次请求只需补上instId
+        self._kline_params = {}
         self.server_jiang_key = os.environ.get('SERVER_JIANG_KEY', 'SCT281228TBF1BQU3KUJ4vLRkykhzIE80e')
-        self.session = requests.Session()
-        self.session.headers.update({
+        self.notification_url = f"https://sctapi.ftqq.com/{self.server_jiang_key}.send"
+        # 新增：扫描中一发现信号，就在后台线程预先建立到Server酱/QuickChart的连接（TCP+TLS握手），
+        # 与剩余的扫描重叠进行，扫描结束后生成图表和发送通知时直接复用连接
+        self.prewarm_notification_connection = True
+        # self.prewarm_notification_connection = os.environ.get('PREWARM_NOTIFICATION_CONNECTION', 'true').lower() == 'true'
+        self._notification_warmup_started = False
+        # OKX请求共用一个aiohttp会话（在scan_market中创建，整个扫描过程复用连接）
+        self.session = None
+        self.request_headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        })
-        self.heartbeat_file = 'last_alert_time.txt'
+        }
+        # 通知、图表短链接等同步请求共用一个Session，同一主机复用keep-alive连接，省去重复TLS握手
+        # 大多数运行没有任何通知要发，Session（连同requests模块）在第一次用到时才创建，见get_http_session
+        self._http_session = None
+        self._http_session_lock = threading.Lock()  # 预热连接、图表线程和主线程都可能首次创建Session
+        # 新增：通知正文gzip压缩上传（消息较大时减少上传量），需确认推送服务支持Content-Encoding: gzip后再开启
+        self.enable_gzip_notification = False
+        # self.enable_gzip_notification = os.environ.get('ENABLE_GZIP_NOTIFICATION', 'false').lower() == 'true'
+        self.heartbeat_file = 'last_alert_time.txt'  # 旧版文本记录，仅用于首次迁移
+        # 新增：监控状态（上次警报时间等）保存在sqlite中，单连接原子读写
+        self.state_db_file = 'monitor_state.db'
+        self._state_conn = None
+        self._last_alert_ts = None  # 上次警报时间的内存缓存，首次读取时从数据库加载
         self.last_billion_pairs_file = 'last_billion_pairs.txt'  # 新增：记录上次过亿交易对
+        # 新增：交易对列表缓存（永续合约列表按天级别变化，无需每次请求）
+        self.inst_cache_file = 'instruments.cache.json'
+        # 缓存按UTC整点时间窗失效（0/6/12/18点），而不是按写入后的滚动时长：同一时间窗内的各次运行共用一份列表，
+        # 新上线的合约最迟6小时内进入监控
+        self.inst_cache_ttl = 6 * 60 * 60  # 时间窗长度（秒）
+        self.refresh_instruments = False  # 为True时忽略缓存强制刷新（--refresh-instruments）
+        # 新增：已确认K线缓存（收盘后的K线不会再变化），保存在监控状态数据库中，每次只请求缓存之后的最新K线
+        self.enable_kline_cache = True
+        # self.enable_kline_cache = os.environ.get('ENABLE_KLINE_CACHE', 'true').lower() == 'true'
+        self.kline_bar_seconds = {'1H': 60 * 60, '4H': 4 * 60 * 60, '1Dutc': 24 * 60 * 60}  # 可缓存的K线周期长度（秒）
+        # 缓存K线按周期分别清理：扫描只用最近44根1H K线（不到2天），日K线历史只用7天，多保留1天余量
+        self.kline_cache_days = {'1H': 3, '4H': 8, '1Dutc': 8}
+        self._pending_kline_rows = []  # 本次扫描新确认的K线，扫描结束后一次性写入缓存
         # 新增：过亿币种新增判断开关配置
         self.enable_billion_new_only = True  # 过亿信号只在有新增币种时发送，可配置
         # 也可以从环境变量读取：
         # self.enable_billion_new_only = os.environ.get('ENABLE_BILLION_NEW_ONLY', 'true').lower() == 'true'
 
         self.heartbeat_interval = 4 * 60 * 60  # 4小时（秒）
+        # 新增：重复推送抑制，与上次推送的警报集合（标题+交易对/周期/触发K线）完全相同且间隔不足该时长时不再发送
+        # 每次运行看到的是新的1H K线，1H爆量不会被判为重复；被抑制的只是同一根K线的再次推送
+        # （手动触发或重跑、4H K线未收盘时的下一次定时运行）。窗口取1.5个运行间隔，覆盖上一次定时运行（含Actions的调度延迟）
+        self.run_interval = 60 * 60  # 定时运行间隔（秒），与monitor_okx.yml中的cron一致
+        self.duplicate_alert_window = self.run_interval * 3 // 2
         # 设置UTC+8时区
-        self.timezone = pytz.timezone('Asia/Shanghai')
+        self.timezone = _TIMEZONE
+        self._time_str_second = None  # get_current_time_str缓存：上次格式化的秒数及结果
+        self._time_str = ''
         # 新增：图表分组配置
         self.chart_group_size = 6  # 每3个币种一个图，可配置
-        self.request_delay = 0.2  # 请求间隔，200ms
+        # OKX请求限速：K线接口约20次/秒（按IP），所有并发请求共享一个发送节奏，留出余量
+        self.max_requests_per_second = 15
+        self.requests_per_second = self.max_requests_per_second  # 当前速率，扫描开始时从上次运行保存的速率恢复
+        self.min_requests_per_second = 2  # 遇到429时速率减半，最低降到该值
+        self.request_burst = 5  # 令牌桶容量：空闲后最多可连续立即发送的请求数（K线接口上限为2秒40次，留足余量）
+        self.rate_recovery_requests = 50  # 连续这么多个请求没有429时速率加1，逐步恢复到上限
+        self._rate_success_streak = 0
+        self._next_request_time = 0  # 下一个请求最早可发送的时间（事件循环时钟）
+        self._last_slow_down_time = None  # 上次降速的时间，同一波429只降速一次
         self.max_retries = 3  # 最大重试次数
+        self.request_timeout = 30  # 单个OKX请求的总超时（秒），设置在整个扫描共用的会话上
+        # 429/5xx/网络错误按指数退避重试：1s, 2s, 4s...，最长5秒，并加随机抖动避免同时重试
+        self.retry_backoff_base = 1
+        self.retry_backoff_max = 5
+        self.max_concurrent_requests = 8  # 同时进行的OKX请求数上限
+        self._request_semaphore = None  # 在事件循环内创建
+        # 爆量倍数标准：1小时10倍，4小时4倍
+        self.volume_ratio_thresholds = {'1H': 10, '4H': 4}
+        # 4小时K线由1小时K线合成，不再单独请求：4*11=44根1小时K线可覆盖当前（可能不完整的）4小时周期和之前10个完整周期
+        self.hour_klines_limit = 4 * _RATIO_WINDOW
+        self.billion_volume_threshold = 100_000_000  # 过亿信号：当天成交额1亿USDT
+        # 新增：扫描前先用一次tickers请求获取所有交易对的24小时成交额，
+        # 低于"最低可触发阈值×安全系数"的交易对不可能产生任何信号，直接跳过K线请求
+        self.enable_ticker_prefilter = True
+        # self.enable_ticker_prefilter = os.environ.get('ENABLE_TICKER_PREFILTER', 'true').lower() == 'true'
+        self.ticker_prefilter_margin = 0.5  # tickers是滚动24小时数据，与K线口径略有差异，留足余量
 
         # 新增：爆量信息开关配置
         self.enable_volume_alerts = True  # 爆量信息总开关
@@ -49,6 +245,19 @@ class OKXVolumeMonitor:
         # 新增：图表开关配置
         self.enable_bar_chart = True   # 或 False
         self.enable_trend_chart = True  # 或 True
+        # 新增：图表使用QuickChart托管短链接（消息里只放短URL，不再嵌入整段图表配置）
+        self.enable_short_chart_url = True
+        # self.enable_short_chart_url = os.environ.get('ENABLE_SHORT_CHART_URL', 'true').lower() == 'true'
+        # 图表渲染尺寸：QuickChart默认devicePixelRatio=2（实际输出2400x800），消息里的图片用1倍即可，
+        # 服务端渲染更快，图片体积约为原来的1/4
+        self.chart_width = 1200
+        self.chart_height = 400
+        self.chart_device_pixel_ratio = 1
+        # 图片格式：柱状图/折线图用JPEG体积只有PNG的几分之一；JPEG没有透明通道，背景填成白色（否则透明处会变黑）
+        self.chart_format = 'jpg'  # 或 'png'
+        self.chart_background_color = 'white'
+        self.chart_request_workers = 4  # 同时创建图表短链接的线程数
+        self._chart_executor = None  # 图表短链接线程池（首次使用时创建）
         # self.enable_bar_chart = os.environ.get('ENABLE_BAR_CHART', 'true').lower() == 'true'  # 柱状图开关
         # self.enable_trend_chart = os.environ.get('ENABLE_TREND_CHART', 'true').lower() == 'true'  # 趋势图开关
         # 新增：图表排除交易对配置（可配置）
@@ -56,141 +265,426 @@ class OKXVolumeMonitor:
 
         
     def get_current_time_str(self):
-        """获取当前UTC+8时间字符串"""
-        return datetime.now(self.timezone).strftime('%Y-%m-%d %H:%M:%S')
+        """获取当前UTC+8时间字符串（同一秒内复用已格式化的结果）"""
+        now = int(time.time())
+        if now != self._time_str_second:
+            self._time_str_second = now
+            self._time_str = datetime.fromtimestamp(now, self.timezone).strftime('%Y-%m-%d %H:%M:%S')
+        return self._time_str
     
-    def get_perpetual_instruments(self):
-        """获取永续合约交易对列表"""
+    def load_cached_instruments(self):
+        """读取本地缓存的交易对列表，缓存不存在或已过期时返回None"""
+        if self.refresh_instruments:
+            return None
         try:
-            url = f"{self.base_url}/api/v5/public/instruments"
-            params = {
-                'instType': 'SWAP'  # 永续合约
-            }
-            
-            response = self.session.get(url, params=params, timeout=30)
-            response.raise_for_status()
+            now = time.time()
+            cache_mtime = os.path.getmtime(self.inst_cache_file)
+            cache_age = now - cache_mtime
+            if cache_age < 0 or int(cache_mtime // self.inst_cache_ttl) != int(now // self.inst_cache_ttl):
+                return None
+            with open(self.inst_cache_file, 'rb') as f:
+                instruments = orjson.loads(f.read())
+            logger.info(f"使用缓存的交易对列表: {len(instruments)} 个（{int(cache_age / 60)} 分钟前更新）")
+            return instruments
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.error(f"读取交易对缓存失败: {e}")
+            return None
+    
+    def save_cached_instruments(self, instruments):
+        """原子写入交易对列表缓存（先写临时文件再替换）"""
+        try:
+            tmp_file = f"{self.inst_cache_file}.tmp"
+            with open(tmp_file, 'wb') as f:
+                f.write(orjson.dumps(instruments))
+            os.replace(tmp_file, self.inst_cache_file)
+        except Exception as e:
+            logger.error(f"写入交易对缓存失败: {e}")
+    
+    async def get_perpetual_instruments(self):
+        """获取永续合约交易对列表（优先使用未过期的本地缓存）"""
+        cached_instruments = self.load_cached_instruments()
+        if cached_instruments:
+            return cached_instruments
+        
+        try:
+            data = await self.safe_request_with_retry(self.instruments_url, params=self.instruments_params)
+            if not data:
+                return []
             
-            data = response.json()
             if data['code'] == '0':
                 instruments = data['data']
-                # 过滤活跃的USDT永续合约
+                # 过滤活跃的USDT永续合约：直接按结算币种判断，不再在instId里查找"USDT"子串
                 active_instruments = [
                     inst for inst in instruments 
-                    if inst['state'] == 'live' and 'USDT' in inst['instId']
+                    if inst['state'] == 'live' and inst.get('settleCcy') == 'USDT'
                 ]
-                print(f"[{self.get_current_time_str()}] 获取到 {len(active_instruments)} 个活跃的USDT永续合约")
+                logger.info(f"获取到 {len(active_instruments)} 个活跃的USDT永续合约")
+                if active_instruments:
+                    self.save_cached_instruments(active_instruments)
                 return active_instruments
             else:
-                print(f"[{self.get_current_time_str()}] 获取交易对失败: {data}")
+                logger.error(f"获取交易对失败: {data}")
                 return []
                 
         except Exception as e:
-            print(f"[{self.get_current_time_str()}] 获取交易对时出错: {e}")
+            logger.error(f"获取交易对时出错: {e}")
             return []
     
-    def safe_request_with_retry(self, url, params=None, timeout=30):
-        """带重试机制的安全请求方法"""
+    async def get_swap_tickers_volume(self):
+        """一次请求获取所有永续合约的24小时成交额（USDT），失败时返回None"""
+        try:
+            data = await self.safe_request_with_retry(self.tickers_url, params=self.instruments_params)
+            if not data or data['code'] != '0':
+                logger.error(f"获取tickers失败: {data}")
+                return None
+            # 永续合约的volCcy24h以币计价，乘以最新价换算成USDT成交额
+            return {
+                ticker['instId']: float(ticker['volCcy24h'] or 0) * float(ticker['last'] or 0)
+                for ticker in data['data']
+            }
+        except Exception as e:
+            logger.error(f"获取tickers时出错: {e}")
+            return None
+    
+    def get_min_signal_volume(self):
+        """能触发任何信号（过亿或通过阈值的爆量）的最低当天成交额"""
+        floor = self.billion_volume_threshold
+        if self.enable_volume_alerts:
+            floor = min(floor, self.volume_alert_daily_threshold)
+        return floor
+    
+    def get_prefilter_volume_floor(self):
+        """tickers预筛选下限：最低可触发成交额乘以安全系数"""
+        return self.get_min_signal_volume() * self.ticker_prefilter_margin
+    
+    async def prefilter_instruments(self, instruments):
+        """用tickers的24小时成交额预筛选交易对，tickers获取失败时返回原列表"""
+        tickers_volume = await self.get_swap_tickers_volume()
+        if not tickers_volume:
+            return instruments
+        
+        floor = self.get_prefilter_volume_floor()
+        # tickers中没有的交易对保留，交给K线扫描判断
+        candidates = [inst for inst in instruments if tickers_volume.get(inst['instId'], floor) >= floor]
+        logger.info(f"tickers预筛选: {len(candidates)}/{len(instruments)} 个交易对24小时成交额不低于 {self.format_volume(floor)}")
+        return candidates
+    
+    async def acquire_request_slot(self):
+        """请求限速（令牌桶）：所有并发请求共享，平均速率为requests_per_second，避免触发429
+
+        按虚拟调度实现：_next_request_time为下一个令牌的理论发放时间，空闲期间最多积攒request_burst个令牌，
+        积攒的令牌可以立即使用，用完后再按固定间隔发放
+        """
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        interval = 1 / self.requests_per_second
+        next_time = max(self._next_request_time, now - (self.request_burst - 1) * interval)
+        slot = max(now, next_time)
+        self._next_request_time = next_time + interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+    
+    def slow_down_requests(self):
+        """遇到429时把请求速率减半（不低于最低速率），1秒内多个请求同时429只降速一次"""
+        now = asyncio.get_running_loop().time()
+        if self._last_slow_down_time is not None and now - self._last_slow_down_time < 1:
+            return
+        self._last_slow_down_time = now
+        self._rate_success_streak = 0
+        new_rate = max(self.min_requests_per_second, self.requests_per_second / 2)
+        if new_rate < self.requests_per_second:
+            self.requests_per_second = new_rate
+            logger.warning(f"遇到429，请求速率降为每秒{new_rate:g}次")
+    
+    def speed_up_requests(self):
+        """请求成功时累计计数，连续rate_recovery_requests个请求没有429就把速率加1（不超过上限）"""
+        if self.requests_per_second >= self.max_requests_per_second:
+            return
+        self._rate_success_streak += 1
+        if self._rate_success_streak >= self.rate_recovery_requests:
+            self._rate_success_streak = 0
+            self.requests_per_second = min(self.max_requests_per_second, self.requests_per_second + 1)
+            logger.info(f"请求持续正常，速率恢复为每秒{self.requests_per_second:g}次")
+    
+    def load_request_rate(self):
+        """读取上次运行结束时的请求速率（限制在最低速率和上限之间），没有记录时使用上限"""
+        try:
+            row = self.get_state_connection().execute(
+                "SELECT v FROM state WHERE k = 'request_rate'"
+            ).fetchone()
+        except Exception as e:
+            logger.error(f"读取请求速率失败: {e}")
+            row = None
+        if not row:
+            return self.max_requests_per_second
+        return min(self.max_requests_per_second, max(self.min_requests_per_second, row[0]))
+    
+    def save_request_rate(self):
+        """保存本次运行结束时的请求速率，下次运行从该速率开始，避免一开始就再次触发429"""
+        try:
+            self.get_state_connection().execute(
+                "INSERT OR REPLACE INTO state VALUES('request_rate', ?)", (self.requests_per_second,)
+            )
+        except Exception as e:
+            logger.error(f"保存请求速率失败: {e}")
+    
+    def get_retry_delay(self, attempt, retry_after=None):
+        """第attempt次失败后的重试等待时间（指数退避+随机抖动），服务端给出Retry-After时至少等待该时长"""
+        delay = min(self.retry_backoff_base * 2 ** attempt, self.retry_backoff_max) * random.uniform(0.5, 1)
+        try:
+            return max(delay, float(retry_after)) if retry_after else delay
+        except ValueError:
+            return delay
+    
+    async def safe_request_with_retry(self, url, params=None):
+        """带重试机制的安全请求方法（异步，返回解析后的JSON）
+
+        429、5xx和网络错误按指数退避重试；其他4xx错误重试也不会成功，直接抛出
+        """
         for attempt in range(self.max_retries):
+            last_attempt = attempt == self.max_retries - 1
             try:
-                # 添加随机延迟，避免请求过于规律
-                time.sleep(self.request_delay)
-                
-                response = self.session.get(url, params=params, timeout=timeout)
-                
-                if response.status_code == 429:
-                    wait_time = (attempt + 1) * 2  # 指数退避：2s, 4s, 6s
-                    print(f"[{self.get_current_time_str()}] 遇到429错误，等待{wait_time}秒后重试...")
-                    time.sleep(wait_time)
-                    continue
+                async with self._request_semaphore:
+                    await self.acquire_request_slot()
                     
-                response.raise_for_status()
-                return response
+                    # 超时设置在会话上（request_timeout），每个请求不再单独构造ClientTimeout
+                    async with self.session.get(url, params=params) as response:
+                        if response.status != 429:
+                            response.raise_for_status()
+                            self.speed_up_requests()
+                            # 使用orjson直接解析原始字节，比response.json()快
+                            return orjson.loads(await response.read())
+                        retry_after = response.headers.get('Retry-After')
+                
+                self.slow_down_requests()
+                if last_attempt:
+                    logger.warning("遇到429错误，已达最大重试次数")
+                    break
+                wait_time = self.get_retry_delay(attempt, retry_after)
+                logger.warning(f"遇到429错误，等待{wait_time:.1f}秒后重试...")
+                await asyncio.sleep(wait_time)
                 
             except Exception as e:
-                if attempt == self.max_retries - 1:
+                if last_attempt or (isinstance(e, aiohttp.ClientResponseError) and e.status < 500):
                     raise e
-                wait_time = (attempt + 1) * 1  # 1s, 2s, 3s
-                print(f"[{self.get_current_time_str()}] 请求失败，{wait_time}秒后重试: {e}")
-                time.sleep(wait_time)
+                wait_time = self.get_retry_delay(attempt)
+                logger.warning(f"请求失败，{wait_time:.1f}秒后重试: {e}")
+                await asyncio.sleep(wait_time)
         
         return None
 
-    def get_kline_data(self, inst_id, bar='1H', limit=20):
-        """获取K线数据（修改版本）"""
-        try:
-            url = f"{self.base_url}/api/v5/market/candles"
-            params = {
-                'instId': inst_id,
-                'bar': bar,
-                'limit': limit
-            }
-
-             # 如果是日线数据，添加UTC+8时区参数
+    def get_kline_params(self, bar, limit):
+        """获取K线请求参数模板（同一bar/limit只构建一次）"""
+        key = (bar, limit)
+        params = self._kline_params.get(key)
+        if params is None:
+            params = {'bar': bar, 'limit': limit}
+            # 如果是日线数据，添加UTC+8时区参数
             if bar == '1D':
                 # 设置UTC+8时区，早上8点作为一天的开始
                 params['utc'] = '8'
-            
-            response = self.safe_request_with_retry(url, params=params)
-            if not response:
+            self._kline_params[key] = params
+        return params
+
+    def load_cached_klines(self, inst_id, bar, limit):
+        """读取缓存的已确认K线，返回(缓存K线, 需要从OKX请求的最新K线数量)，缓存不可用时返回None
+
+        缓存必须是从所需最早一根开始的连续K线；只缺最新的几根时只请求缺少的部分（至少2根）
+        """
+        period = self.kline_bar_seconds.get(bar)
+        if not self.enable_kline_cache or period is None or limit <= 2:
+            return None
+        
+        try:
+            period_ms = period * 1000
+            current_start = int(time.time() * 1000) // period_ms * period_ms  # 当前未收盘K线的开始时间
+            # 最新2根（当前K线和上一根）每次都重新请求，更早的limit-2根优先从缓存读取
+            newest_ts = current_start - 2 * period_ms
+            oldest_ts = current_start - (limit - 1) * period_ms
+            rows = self.get_state_connection().execute(
+                "SELECT ts, candle FROM klines WHERE inst_id = ? AND bar = ? AND ts BETWEEN ? AND ? ORDER BY ts DESC",
+                (inst_id, bar, oldest_ts, newest_ts)
+            ).fetchall()
+            # 缓存需从最早一根开始连续（ts唯一，首尾间隔正好等于根数即无空洞），否则整段重新请求
+            if not rows or rows[-1][0] != oldest_ts or rows[0][0] - oldest_ts != (len(rows) - 1) * period_ms:
+                return None
+            missing = limit - 2 - len(rows)  # 上次运行之后新收盘、尚未缓存的K线数
+            return [orjson.loads(candle) for _, candle in rows], missing + 2
+        except Exception as e:
+            logger.error(f"读取{inst_id}的K线缓存失败: {e}")
+            return None
+    
+    def save_cached_klines(self, inst_id, bar, klines):
+        """记录已确认（confirm为1）的K线，由flush_cached_klines在扫描结束后统一写入缓存"""
+        if not self.enable_kline_cache or bar not in self.kline_bar_seconds:
+            return
+        
+        self._pending_kline_rows.extend(
+            (inst_id, bar, int(candle[0]), orjson.dumps(candle)) for candle in klines if candle[8] == '1'
+        )
+    
+    def flush_cached_klines(self):
+        """将本次扫描记录的K线在同一事务内批量写入缓存（每个交易对单独提交会在扫描中阻塞事件循环）"""
+        rows, self._pending_kline_rows = self._pending_kline_rows, []
+        if not rows:
+            return
+        
+        try:
+            conn = self.get_state_connection()
+            conn.execute("BEGIN")
+            try:
+                conn.executemany("INSERT OR REPLACE INTO klines VALUES(?, ?, ?, ?)", rows)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except Exception as e:
+            logger.error(f"写入K线缓存失败: {e}")
+    
+    async def get_kline_data(self, inst_id, bar='1H', limit=20):
+        """获取K线数据（已确认K线优先读缓存，只请求缓存之后的最新K线）"""
+        cached = self.load_cached_klines(inst_id, bar, limit)
+        if cached is None:
+            klines = await self.fetch_kline_data(inst_id, bar, limit)
+            self.save_cached_klines(inst_id, bar, klines)
+            return klines
+        
+        cached_klines, fetch_limit = cached
+        latest_klines = await self.fetch_kline_data(inst_id, bar, fetch_limit)
+        if not latest_klines:
+            return []
+        self.save_cached_klines(inst_id, bar, latest_klines)
+        
+        # 最新K线在前，拼接上更早的缓存K线
+        oldest_latest_ts = int(latest_klines[-1][0])
+        klines = latest_klines + [candle for candle in cached_klines if int(candle[0]) < oldest_latest_ts]
+        return klines[:limit]
+    
+    async def get_kline_array(self, inst_id, bar='1H', limit=20):
+        """获取K线数据并解析为float64矩阵（每行一根K线，列见_KLINE_*常量），字符串只转换一次"""
+        return parse_klines(await self.get_kline_data(inst_id, bar, limit))
+    
+    async def fetch_kline_data(self, inst_id, bar='1H', limit=20):
+        """从OKX请求K线数据（不经过缓存）"""
+        try:
+            params = dict(self.get_kline_params(bar, limit), instId=inst_id)
+            data = await self.safe_request_with_retry(self.candles_url, params=params)
+            if not data:
                 return []
-                
-            data = response.json()
+            
             if data['code'] == '0':
                 return data['data']
             else:
-                print(f"[{self.get_current_time_str()}] 获取{inst_id}的K线数据失败: {data}")
+                logger.error(f"获取{inst_id}的K线数据失败: {data}")
                 return []
                 
         except Exception as e:
-            print(f"[{self.get_current_time_str()}] 获取{inst_id}的K线数据时出错: {e}")
+            logger.error(f"获取{inst_id}的K线数据时出错: {e}")
             return []
     
-    def calculate_volume_ratio(self, kline_data):
-        """计算交易量倍数"""
-        if len(kline_data) < 11:  # 需要至少11个数据点（当前+前10个用于MA10）
-            return None, None
-        
-        # OKX K线数据格式: [ts, o, h, l, c, vol, volCcy, volCcyQuote, confirm]
-        # volCcyQuote 是以计价货币计算的交易量（交易额）
-        volumes = [float(candle[7]) for candle in kline_data]  # 使用交易额
+    def resample_hour_volumes(self, hour_klines, hours):
+        """用1小时K线矩阵合成N小时周期的交易额（按UTC整点对齐分组，最新的在前）
+
+        当前周期可以不完整（与OKX返回的未收盘K线一致），更早的周期如果因数据窗口截断而不完整则丢弃
+        """
+        if not len(hour_klines):
+            return np.empty(0)
         
-        current_volume = volumes[0]  # 最新的交易量
-        prev_volume = volumes[1] if len(volumes) > 1 else 0  # 前一个周期的交易量
+        buckets = hour_klines[:, _KLINE_TS].astype(np.int64) // (hours * 60 * 60 * 1000)
+        # K线按时间从新到旧排列，同一周期的K线相邻，一次reduceat求出每个周期的交易额合计
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        counts = np.diff(np.r_[starts, len(buckets)])
+        volumes = np.add.reduceat(hour_klines[:, _KLINE_VOL_QUOTE], starts)
         
-        # 计算MA10（前10个周期的平均交易量，不包括当前周期）
-        ma10_volumes = volumes[1:11] if len(volumes) >= 11 else volumes[1:]
-        ma10_volume = np.mean(ma10_volumes) if ma10_volumes else 0
+        incomplete = np.flatnonzero(counts[1:] < hours)
+        if len(incomplete):
+            volumes = volumes[:incomplete[0] + 1]
+        return volumes
+
+    def calculate_volume_ratios(self, volumes, thresholds):
+        """批量筛选爆量并计算交易量倍数（向量化）
+
+        volumes为 (M, 11) 的float32矩阵，每行是一个交易对按时间从新到旧的交易额窗口（见volume_window），
+        thresholds为每行的爆量倍数标准。
+        返回 (indexes, current_volumes, prev_ratios, ma10_ratios)，只包含达到爆量标准的行，
+        indexes为这些行在volumes中的下标；倍数用float64计算，未达到标准的那一项为NaN
+        """
+        current = volumes[:, 0]  # 最新的交易量
+        prev = volumes[:, 1]  # 前一个周期的交易量
+        ma10 = volumes[:, 1:_RATIO_WINDOW].mean(axis=1)  # MA10（前10个周期，不包括当前周期）
         
-        # 计算倍数
-        prev_ratio = current_volume / prev_volume if prev_volume > 0 else 0
-        ma10_ratio = current_volume / ma10_volume if ma10_volume > 0 else 0
+        # 先用乘法判断（current >= T*prev 等价于 current/prev >= T），只对爆量的行做除法；
+        # 交易量都需大于0，且至少一个倍数达到标准。数据不足的行为NaN，比较结果为False，自然不会触发
+        # 每一项是否达标也以同样的乘法比较为准，避免float32除法结果在临界处略小于T而与筛选结果不一致
+        valid = (current > 0) & (prev > 0) & (ma10 > 0)
+        prev_hit = valid & (current >= thresholds * prev)
+        ma10_hit = valid & (current >= thresholds * ma10)
+        indexes = np.flatnonzero(prev_hit | ma10_hit)
+        current = current[indexes]
+        current64 = current.astype(np.float64)
+        prev_ratios = np.where(prev_hit[indexes], current64 / prev[indexes], np.nan)
+        ma10_ratios = np.where(ma10_hit[indexes], current64 / ma10[indexes], np.nan)
         
-        return prev_ratio, ma10_ratio
-
+        return indexes, current, prev_ratios, ma10_ratios
 
+    def build_volume_alerts(self, snapshots):
+        """对一批交易对的K线统一做爆量判断，生成爆量警报列表"""
+        alerts = []
+        if not snapshots:
+            return alerts
+        
+        # 所有时间周期的K线堆叠成一个矩阵，一次归约完成全部判断（第k个周期占第k段N行）
+        timeframes = list(self.volume_ratio_thresholds)
+        thresholds = np.repeat(
+            np.array([self.volume_ratio_thresholds[timeframe] for timeframe in timeframes], dtype=np.float32),
+            len(snapshots)
+        )
+        indexes, current, prev_ratios, ma10_ratios = self.calculate_volume_ratios(
+            np.vstack([snapshot['volumes'][timeframe] for timeframe in timeframes for snapshot in snapshots]),
+            thresholds
+        )
+        
+        # 所有警报的当前交易额一次批量格式化
+        for index, current_volume, current_vol_fmt, prev_ratio, ma10_ratio in zip(
+            indexes.tolist(), current.tolist(), format_volume_array(current), prev_ratios.tolist(), ma10_ratios.tolist()
+        ):
+            timeframe_index, row = divmod(index, len(snapshots))
+            timeframe = timeframes[timeframe_index]
+            snapshot = snapshots[row]  # current_volume为最新K线的volCcyQuote字段
+            alerts.append({
+                'inst_id': snapshot['inst_id'],
+                'inst_name': snapshot['inst_name'],
+                'timeframe': timeframe,
+                'bar_ts': snapshot['bar_ts'][timeframe],  # 触发爆量的K线开始时间（毫秒）
+                'current_volume': current_volume,
+                'current_vol_fmt': current_vol_fmt,
+                'prev_ratio': None if np.isnan(prev_ratio) else prev_ratio,
+                'ma10_ratio': None if np.isnan(ma10_ratio) else ma10_ratio,
+                'daily_volume': snapshot['daily_volume'],
+                'daily_vol_fmt': snapshot['daily_vol_fmt'],
+                'price_change_24h': snapshot['price_change_24h']  # 添加涨跌幅
+            })
+        
+        return alerts
 
-    
-    def get_daily_volumes_history(self, inst_id, days=7):
-        """获取交易对过去N天的日交易额历史"""
+    async def get_daily_volumes_history(self, inst_id, days=7):
+        """获取交易对过去N天的日交易额历史（结构化数组，字段volume/ts，按时间从近到远排序）"""
         try:
-            # 获取日K线数据
-            daily_klines = self.get_kline_data(inst_id, '1Dutc', days)
-            if daily_klines:
-                # 返回每天的交易额列表，按时间从近到远排序
-                daily_volumes = []
-                for kline in daily_klines:
-                    timestamp = int(kline[0]) / 1000  # 转换为秒
-                    date = datetime.fromtimestamp(timestamp, self.timezone).strftime('%m-%d')
-                    volume = float(kline[7])  # 交易额
-                    daily_volumes.append({
-                        'date': date,
-                        'volume': volume
-                    })
-                return daily_volumes
-            return []
+            # 获取日K线数据（已解析为矩阵）
+            daily_klines = await self.get_kline_array(inst_id, '1Dutc', days)
+            history = np.empty(len(daily_klines), dtype=_DAILY_HISTORY_DTYPE)
+            history['volume'] = daily_klines[:, _KLINE_VOL_QUOTE]  # 交易额
+            history['ts'] = daily_klines[:, _KLINE_TS].astype(np.int64) // 1000  # 转换为秒
+            return history
         except Exception as e:
-            print(f"[{self.get_current_time_str()}] 获取{inst_id}历史日交易额时出错: {e}")
-            return []
+            logger.error(f"获取{inst_id}历史日交易额时出错: {e}")
+            return np.empty(0, dtype=_DAILY_HISTORY_DTYPE)
+    
+    def format_history_dates(self, history):
+        """将日交易额历史的时间戳格式化为日期字符串（MM-DD）"""
+        return [datetime.fromtimestamp(ts, self.timezone).strftime('%m-%d') for ts in history['ts'].tolist()]
 
     #should_send_volume_alert(self, alert)：检查是否应该发送爆量警报
     def should_send_volume_alert(self, alert):
@@ -202,165 +696,252 @@ class OKXVolumeMonitor:
         daily_volume = alert.get('daily_volume', 0)
         return daily_volume >= self.volume_alert_daily_threshold
         
-    def check_volume_explosion_batch(self, instruments_batch):
-        """批量检查多个交易对的爆量情况（修改版本：添加阈值过滤）"""
-        alerts = []
-        billion_volume_alerts = []
-        
-        # 减少并发数，避免429错误
-        with ThreadPoolExecutor(max_workers=3) as executor:
-            # 提交所有任务
-            future_to_inst = {
-                executor.submit(self.check_single_instrument_volume, inst['instId']): inst['instId'] 
-                for inst in instruments_batch
-            }
+    async def check_volume_explosion_batch(self, instruments_batch):
+        """批量检查多个交易对的爆量情况（修改版本：添加阈值过滤，爆量倍数统一向量化计算）"""
+        # 所有交易对并发获取，实际请求并发数由_request_semaphore限制，避免429错误
+        # 不再给单个交易对设总超时：排队等待信号量的时间也会被计入，每个请求已有自己的超时和重试
+        inst_ids = [inst['instId'] for inst in instruments_batch]
+        
+        async def check_with_index(index, inst_id):
+            try:
+                return index, await self.check_single_instrument_volume(inst_id)
+            except Exception as e:
+                return index, e
+        
+        # 按完成顺序逐个处理结果（先完成的交易对不必等待前面的慢请求），
+        # 结果按原始下标存放，保证后续警报顺序与交易对列表一致
+        results = [(None, None)] * len(inst_ids)
+        # BTC/ETH等每次都过亿，只有新增的过亿交易对才可能触发推送，才值得预先连接
+        last_billion_pairs = set(self.get_last_billion_pairs())
+        for next_done in asyncio.as_completed([check_with_index(i, inst_id) for i, inst_id in enumerate(inst_ids)]):
+            index, result = await next_done
+            if isinstance(result, Exception):
+                logger.error(f"检查 {inst_ids[index]} 时出错: {result!r}")
+                continue
             
-            # 收集结果
-            for future in future_to_inst:
-                inst_id = future_to_inst[future]
-                try:
-                    inst_alerts, billion_alert = future.result(timeout=60)
-                    
-                    # 过滤爆量警报：只有通过阈值检查的才添加
-                    if inst_alerts:
-                        filtered_alerts = []
-                        for alert in inst_alerts:
-                            if self.should_send_volume_alert(alert):
-                                filtered_alerts.append(alert)
-                                print(f"[{self.get_current_time_str()}] 发现爆量(通过阈值): {inst_id} 当天成交额: {self.format_volume(alert['daily_volume'])}")
-                            else:
-                                print(f"[{self.get_current_time_str()}] 发现爆量(未达阈值): {inst_id} 当天成交额: {self.format_volume(alert.get('daily_volume', 0))} < {self.format_volume(self.volume_alert_daily_threshold)}")
-                        
-                        if filtered_alerts:
-                            alerts.extend(filtered_alerts)
-                    
-                    if billion_alert:
-                        billion_volume_alerts.append(billion_alert)
-                        print(f"[{self.get_current_time_str()}] 发现过亿成交: {inst_id}")
-                        
-                except Exception as e:
-                    print(f"[{self.get_current_time_str()}] 检查 {inst_id} 时出错: {e}")
-                    continue
+            results[index] = result
+            if result[1]:
+                logger.info(f"发现过亿成交: {inst_ids[index]}")
+                if inst_ids[index] not in last_billion_pairs:
+                    self.start_notification_warmup()
+        
+        snapshots = [snapshot for snapshot, _ in results if snapshot]
+        billion_volume_alerts = [billion_alert for _, billion_alert in results if billion_alert]
+        
+        # 所有K线获取完成后，一次性计算整批交易对的爆量倍数
+        alerts = []
+        threshold_fmt = self.format_volume(self.volume_alert_daily_threshold)
+        for alert in self.build_volume_alerts(snapshots):
+            # 过滤爆量警报：只有通过阈值检查的才添加
+            inst_id = alert['inst_id']
+            if self.should_send_volume_alert(alert):
+                alerts.append(alert)
+                self.start_notification_warmup()
+                logger.info(f"发现爆量(通过阈值): {inst_id} 当天成交额: {alert['daily_vol_fmt']}")
+            else:
+                logger.info(f"发现爆量(未达阈值): {inst_id} 当天成交额: {alert['daily_vol_fmt']} < {threshold_fmt}")
         
         return alerts, billion_volume_alerts
     
-    def get_daily_volume(self, inst_id):
-        """获取交易对当天的交易额"""
-        try:
-            # 获取24小时的1小时K线数据
-            daily_data = self.get_kline_data(inst_id, '1H', 24)
-            if daily_data:
-                # 计算当天总交易额（所有小时K线的交易额之和）
-                total_volume = sum(float(candle[7]) for candle in daily_data)
-                return total_volume
-            return 0
-        except Exception as e:
-            print(f"[{self.get_current_time_str()}] 获取{inst_id}当天交易额时出错: {e}")
-            return 0
+    async def attach_daily_histories(self, alerts, billion_alerts):
+        """为最终要展示的警报补充日交易额历史：爆量表格取前3天，过亿表格和趋势图使用全部7天
+
+        由scan_market在plan_notification确定要推送之后调用：只传入本次推送的爆量警报和（要推送时的）过亿警报，
+        对这一小部分交易对并发请求，同一交易对（如1H和4H同时爆量且过亿）只请求一次
+        """
+        inst_ids = list(dict.fromkeys([alert['inst_id'] for alert in billion_alerts] + [alert['inst_id'] for alert in alerts]))
+        if not inst_ids:
+            return
+        
+        histories = dict(zip(inst_ids, await asyncio.gather(
+            *(self.get_daily_volumes_history(inst_id, 7) for inst_id in inst_ids)
+        )))
+        for billion_alert in billion_alerts:
+            billion_alert['daily_volumes_history'] = histories[billion_alert['inst_id']]
+        for alert in alerts:
+            past_3days_volumes = histories[alert['inst_id']][:3]
+            alert['past_3days_volumes'] = past_3days_volumes
+            alert['past_3days_fmt'] = format_volume_array(past_3days_volumes['volume'])
     
      # 1. 修改 check_single_instrument_volume 方法，添加价格变化计算
-    def check_single_instrument_volume(self, inst_id):
-        """检查单个交易对是否出现爆量和过亿成交"""
-        alerts = []
+    async def check_single_instrument_volume(self, inst_id):
+        """获取单个交易对的成交数据并检查过亿成交（爆量倍数在批量阶段统一计算）"""
         billion_alert = None
         
         try:
-            # 获取当天交易额（通过get_daily_volume方法，即24小时内1小时K线的volCcyQuote字段之和）
-            daily_volume = self.get_daily_volume(inst_id)
+            # 1小时K线只请求一次：当天交易额、24H涨跌幅、1H爆量判断和合成4小时K线共用
+            # K线已解析为float64矩阵，后续计算都直接使用矩阵的列
+            hour_klines = await self.get_kline_array(inst_id, '1H', self.hour_klines_limit)
+            hour_volumes = hour_klines[:, _KLINE_VOL_QUOTE]
+            
+            # 当天交易额：24小时内1小时K线的volCcyQuote字段之和
+            daily_volume = float(hour_volumes[:24].sum())
             
-            # 获取过去3天的交易额数据（用于表格显示）
-            past_3days_volumes = self.get_daily_volumes_history(inst_id, 3)
+            # 日交易额历史不在这里请求：确定要推送后只为推送的交易对统一获取（见attach_daily_histories）
             
-            # 获取24小时K线数据计算涨跌幅
-            daily_klines = self.get_kline_data(inst_id, '1H', 24)
+            # 计算24H涨跌幅
             price_change_24h = 0
-            if daily_klines and len(daily_klines) >= 24:
-                current_price = float(daily_klines[0][4])  # 最新收盘价
-                price_24h_ago = float(daily_klines[23][4])  # 24小时前收盘价
+            if len(hour_klines) >= 24:
+                current_price = float(hour_klines[0, _KLINE_CLOSE])  # 最新收盘价
+                price_24h_ago = float(hour_klines[23, _KLINE_CLOSE])  # 24小时前收盘价
                 if price_24h_ago > 0:
                     price_change_24h = (current_price - price_24h_ago) / price_24h_ago * 100
             
+            # 显示用字段只计算一次，1H/4H警报和各表格直接复用
+            inst_name = inst_id.replace('-SWAP', '').replace('-USDT', '')
+            daily_vol_fmt = self.format_volume(daily_volume)
+            
             # 检查是否过亿
-            if daily_volume >= 100_000_000:  # 1亿USDT
-                # 获取过去7天的日交易额历史
-                daily_volumes_history = self.get_daily_volumes_history(inst_id, 7)
+            if daily_volume >= self.billion_volume_threshold:  # 1亿USDT
                 billion_alert = {
                     'inst_id': inst_id,
+                    'inst_name': inst_name,
                     'current_daily_volume': daily_volume,
-                    'daily_volumes_history': daily_volumes_history,
+                    'current_vol_fmt': daily_vol_fmt,
                     'price_change_24h': price_change_24h  # 添加涨跌幅
                 }
             
-            # 检查1小时爆量
-            hour_data = self.get_kline_data(inst_id, '1H', 20)
-            if hour_data:
-                prev_ratio, ma10_ratio = self.calculate_volume_ratio(hour_data)
-                if prev_ratio and ma10_ratio:
-                    # 当前交易额来源：最新1小时K线的volCcyQuote字段（hour_data[0][7]）
-                    current_volume = float(hour_data[0][7])
-                    
-                    # 小时爆量标准：10倍
-                    if prev_ratio >= 10 or ma10_ratio >= 10:
-                        alert_data = {
-                            'inst_id': inst_id,
-                            'timeframe': '1H',
-                            'current_volume': current_volume,
-                            'prev_ratio': prev_ratio if prev_ratio >= 10 else None,
-                            'ma10_ratio': ma10_ratio if ma10_ratio >= 10 else None,
-                            'daily_volume': daily_volume,
-                            'past_3days_volumes': past_3days_volumes,
-                            'price_change_24h': price_change_24h  # 添加涨跌幅
-                        }
-                        alerts.append(alert_data)
+            # 4小时交易额由1小时K线合成，爆量倍数由build_volume_alerts统一计算
+            four_hour_volumes = self.resample_hour_volumes(hour_klines, 4)
             
-            # 检查4小时爆量
-            four_hour_data = self.get_kline_data(inst_id, '4H', 20)
-            if four_hour_data:
-                prev_ratio, ma10_ratio = self.calculate_volume_ratio(four_hour_data)
-                if prev_ratio and ma10_ratio:
-                    # 当前交易额来源：最新4小时K线的volCcyQuote字段（four_hour_data[0][7]）
-                    current_volume = float(four_hour_data[0][7])
-                    
-                    # 4小时爆量标准：5倍  修改成4倍
-                    if prev_ratio >= 4 or ma10_ratio >= 4:
-                        alert_data = {
-                            'inst_id': inst_id,
-                            'timeframe': '4H',
-                            'current_volume': current_volume,
-                            'prev_ratio': prev_ratio if prev_ratio >= 4 else None,
-                            'ma10_ratio': ma10_ratio if ma10_ratio >= 4 else None,
-                            'daily_volume': daily_volume,
-                            'past_3days_volumes': past_3days_volumes,
-                            'price_change_24h': price_change_24h  # 添加涨跌幅
-                        }
-                        alerts.append(alert_data)
+            # 当前（最新）1H/4H K线的开始时间（毫秒），用于区分同一交易对在不同K线上的爆量
+            latest_ts = int(hour_klines[0, _KLINE_TS]) if len(hour_klines) else 0
+            four_hour_ms = 4 * 60 * 60 * 1000
+            
+            snapshot = {
+                'inst_id': inst_id,
+                'inst_name': inst_name,
+                'daily_volume': daily_volume,
+                'daily_vol_fmt': daily_vol_fmt,
+                'price_change_24h': price_change_24h,
+                'volumes': {
+                    '1H': volume_window(hour_volumes),
+                    '4H': volume_window(four_hour_volumes)
+                },
+                'bar_ts': {
+                    '1H': latest_ts,
+                    '4H': latest_ts // four_hour_ms * four_hour_ms
+                }
+            }
             
-            return alerts, billion_alert
+            return snapshot, billion_alert
             
         except Exception as e:
-            print(f"[{self.get_current_time_str()}] 检查 {inst_id} 时出错: {e}")
-            return [], None
+            logger.error(f"检查 {inst_id} 时出错: {e}")
+            return None, None
 
     
+    def get_http_session(self):
+        """获取通知/图表请求共用的requests.Session（首次使用时才导入requests并创建，可在多个线程中调用）"""
+        with self._http_session_lock:
+            if self._http_session is None:
+                # requests导入约需0.1秒，没有通知要发的运行完全不加载
+                import requests
+                from requests.adapters import HTTPAdapter
+                from urllib3.util.retry import Retry
+                self._http_session = requests.Session()
+                # 连接池大小与图表线程数一致，并发创建短链接时每个线程都能复用keep-alive连接；
+                # 只重试连接失败（请求还没发出去），POST不会因重试而重复发送通知
+                adapter = HTTPAdapter(
+                    pool_connections=2,  # 只访问Server酱和QuickChart两个主机
+                    pool_maxsize=max(self.chart_request_workers, 1),
+                    max_retries=Retry(total=3, connect=3, read=0, status=0, backoff_factor=0.3)
+                )
+                self._http_session.mount('https://', adapter)
+            return self._http_session
+    
+    def get_state_connection(self):
+        """获取监控状态数据库连接（首次使用时创建）"""
+        if self._state_conn is None:
+            self._state_conn = sqlite3.connect(self.state_db_file, isolation_level=None)
+            self._state_conn.execute("CREATE TABLE IF NOT EXISTS state(k TEXT PRIMARY KEY, v REAL)")
+            self._state_conn.execute(
+                "CREATE TABLE IF NOT EXISTS klines(inst_id TEXT, bar TEXT, ts INTEGER, candle BLOB, PRIMARY KEY(inst_id, bar, ts))"
+            )
+            # 按周期清理过期的K线缓存，避免数据库无限增长
+            now = time.time()
+            self._state_conn.executemany(
+                "DELETE FROM klines WHERE bar = ? AND ts < ?",
+                [(bar, int((now - days * 24 * 60 * 60) * 1000)) for bar, days in self.kline_cache_days.items()]
+            )
+        return self._state_conn
+    
     def get_last_alert_time(self):
-        """获取上次发送爆量警报的时间"""
+        """获取上次发送爆量警报的时间（同一次运行内只读一次数据库，之后使用内存缓存）"""
+        if self._last_alert_ts is None:
+            self._last_alert_ts = self.load_last_alert_time()
+        return self._last_alert_ts
+    
+    def load_last_alert_time(self):
+        """从监控状态数据库读取上次发送爆量警报的时间"""
         try:
+            row = self.get_state_connection().execute(
+                "SELECT v FROM state WHERE k = 'last_alert'"
+            ).fetchone()
+            if row:
+                return row[0]
+            
+            # 兼容旧版：数据库中还没有记录时，读取一次原来的文本文件并迁移到数据库，之后不再读文件
             if os.path.exists(self.heartbeat_file):
                 with open(self.heartbeat_file, 'r') as f:
-                    timestamp = float(f.read().strip())
-                    return timestamp
+                    last_alert_time = float(f.read().strip())
+                self.get_state_connection().execute(
+                    "INSERT OR REPLACE INTO state VALUES('last_alert', ?)", (last_alert_time,)
+                )
+                return last_alert_time
             return 0
         except Exception as e:
-            print(f"[{self.get_current_time_str()}] 读取上次警报时间失败: {e}")
+            logger.error(f"读取上次警报时间失败: {e}")
             return 0
     
-    def update_last_alert_time(self):
-        """更新上次发送爆量警报的时间"""
+    def update_last_alert_time(self, timestamp=None):
+        """更新上次发送爆量警报的时间（与缓存值相同时不写数据库）"""
+        if timestamp is None:
+            timestamp = time.time()
+        if timestamp == self._last_alert_ts:
+            return
         try:
-            with open(self.heartbeat_file, 'w') as f:
-                f.write(str(time.time()))
+            self.get_state_connection().execute(
+                "INSERT OR REPLACE INTO state VALUES('last_alert', ?)", (timestamp,)
+            )
+            self._last_alert_ts = timestamp
         except Exception as e:
-            print(f"[{self.get_current_time_str()}] 更新上次警报时间失败: {e}")
+            logger.error(f"更新上次警报时间失败: {e}")
+    
+    def get_alert_digest(self, title, alerts, billion_alerts):
+        """警报集合的摘要：标题+爆量交易对/周期/K线+过亿交易对，与图表链接、监控时间等每次都会变化的内容无关
+
+        爆量按触发的K线区分：下一根1H K线上的爆量是新的信号，不会被当作重复推送
+        """
+        key = orjson.dumps([
+            title,
+            sorted((alert['inst_id'], alert['timeframe'], alert['bar_ts']) for alert in alerts),
+            sorted(alert['inst_id'] for alert in billion_alerts)
+        ])
+        # 取52位，可无损保存在state表的REAL列中
+        return int(hashlib.sha1(key).hexdigest()[:13], 16)
+    
+    def is_duplicate_alert(self, digest):
+        """检查是否在duplicate_alert_window内已推送过相同的警报集合"""
+        try:
+            rows = dict(self.get_state_connection().execute(
+                "SELECT k, v FROM state WHERE k IN ('last_alert_digest', 'last_alert_digest_ts')"
+            ).fetchall())
+        except Exception as e:
+            logger.error(f"读取上次推送摘要失败: {e}")
+            return False
+        # 与摘要一起保存的推送时间比较；last_alert在发送心跳后也会更新，不能用来判断摘要是否过期
+        return rows.get('last_alert_digest') == digest and time.time() - rows.get('last_alert_digest_ts', 0) < self.duplicate_alert_window
+    
+    def update_last_alert_digest(self, digest, timestamp):
+        """记录本次推送的警报集合摘要及推送时间（只在警报推送成功后调用，心跳不更新）"""
+        try:
+            self.get_state_connection().executemany(
+                "INSERT OR REPLACE INTO state VALUES(?, ?)",
+                [('last_alert_digest', digest), ('last_alert_digest_ts', timestamp)]
+            )
+        except Exception as e:
+            logger.error(f"更新推送摘要失败: {e}")
     
     def should_send_heartbeat(self):
         """检查是否需要发送心跳消息"""
@@ -372,201 +953,124 @@ class OKXVolumeMonitor:
     
     def format_volume(self, volume):
         """格式化交易额显示"""
-        if volume >= 1_000_000_000:  # 10亿
-            return f"{volume/1_000_000_000:.2f}B"
-        elif volume >= 1_000_000:  # 100万
-            return f"{volume/1_000_000:.0f}M"
-        elif volume >= 1_000:  # 1千
-            return f"{volume/1_000:.0f}K"
-        else:
-            return f"{volume:.0f}"
+        return format_volume(volume)
+    
     
+    def build_chart_url(self, chart_config):
+        """将Chart.js配置转换为QuickChart图片URL（优先使用托管短链接，失败时退回完整URL）"""
+        if self.enable_short_chart_url:
+            try:
+                # 请求体同样用orjson序列化，不经过requests内部的json.dumps
+                response = self.get_http_session().post(
+                    "https://quickchart.io/chart/create",
+                    data=orjson.dumps({
+                        'chart': chart_config,
+                        'width': self.chart_width,
+                        'height': self.chart_height,
+                        'devicePixelRatio': self.chart_device_pixel_ratio,
+                        'backgroundColor': self.chart_background_color,
+                        'format': self.chart_format
+                    }),
+                    headers={'Content-Type': 'application/json'},
+                    timeout=10
+                )
+                response.raise_for_status()
+                result = orjson.loads(response.content)
+                if result.get('success'):
+                    return result['url']
+                logger.error(f"创建图表短链接失败: {result}")
+            except Exception as e:
+                logger.error(f"创建图表短链接时出错: {e}，改用完整URL")
+        
+        # orjson输出紧凑的UTF-8字节（无多余空格、中文不转义成\uXXXX），URL明显更短，直接按字节编码
+        encoded_chart = urllib.parse.quote_from_bytes(orjson.dumps(chart_config), safe='')
+        return (
+            f"https://quickchart.io/chart?c={encoded_chart}&width={self.chart_width}&height={self.chart_height}"
+            f"&devicePixelRatio={self.chart_device_pixel_ratio}"
+            f"&backgroundColor={self.chart_background_color}&format={self.chart_format}"
+        )
+    
+    def build_chart_urls(self, chart_configs):
+        """并发为多个图表生成URL，返回顺序与chart_configs一致
+
+        每个短链接都要单独请求一次QuickChart，串行时总耗时是各次往返之和，改为线程池同时请求
+        """
+        if len(chart_configs) <= 1:
+            return [self.build_chart_url(chart_config) for chart_config in chart_configs]
+        return list(self.get_chart_executor().map(self.build_chart_url, chart_configs))
+    
+    def get_chart_executor(self):
+        """图表短链接、连接预热共用的线程池（首次使用时创建，不再每次调用都新建和销毁线程）"""
+        if self._chart_executor is None:
+            self._chart_executor = ThreadPoolExecutor(max_workers=self.chart_request_workers, thread_name_prefix='chart')
+        return self._chart_executor
+    
+    def start_notification_warmup(self):
+        """发现可能要推送的信号（通过阈值的爆量、新增的过亿交易对）时调用：在后台线程预先连接通知和图表服务，每次运行只触发一次
+
+        通知内容依赖全部扫描结果，不能提前发送；但连接可以提前建立，把握手延迟藏在剩余的扫描时间里
+        """
+        if not self.prewarm_notification_connection or self._notification_warmup_started:
+            return
+        self._notification_warmup_started = True
+        warmup_urls = ["https://sctapi.ftqq.com/"]
+        if self.enable_bar_chart or self.enable_trend_chart:
+            warmup_urls.append("https://quickchart.io/")
+        for url in warmup_urls:
+            self.get_chart_executor().submit(self.warm_up_connection, url)
+    
+    def warm_up_connection(self, url):
+        """发一个HEAD请求建立连接，连接随后留在Session的连接池中；失败不影响后续正常请求
+
+        在线程池中运行，导入requests和创建Session也不占用扫描所在的事件循环线程
+        """
+        try:
+            self.get_http_session().head(url, timeout=5, allow_redirects=False)
+        except Exception as e:
+            logger.warning(f"预先连接 {url} 失败: {e}")
     
     # 2. 完全替换 generate_chart_url_quickchart 方法
     def generate_chart_url_quickchart(self, billion_alerts):
-        """使用QuickChart生成图表URL（修改版本：分成10亿以上、3-10亿、1-3亿三个图表）"""
+        """使用QuickChart生成图表URL（修改版本：分成10亿以上、3-10亿、1-3亿三个图表），billion_alerts需已按交易额排序"""
         if not billion_alerts or len(billion_alerts) == 0:
             return []
         
         try:
-            # 不再过滤任何交易对，包含所有过亿的交易对
-            all_alerts = billion_alerts
-            
-            # 按成交额分组：10亿以上、3-10亿、1-3亿
-            above_10b = []      # 10亿以上
-            between_3_10b = []  # 3-10亿
-            between_1_3b = []   # 1-3亿
-            
-            for alert in all_alerts:
+            # 按成交额分组：(下限, 换算除数, 小数位, 单位, 标题后缀)，不再过滤任何交易对
+            buckets = (
+                (1_000_000_000, 1_000_000_000, 2, '十亿USDT', '10亿以上'),
+                (300_000_000, 100_000_000, 2, '亿USDT', '3-10亿区间'),
+                (0, 10_000_000, 1, '千万USDT', '1-3亿区间'),  # billion_alerts已经是过亿的
+            )
+            grouped_alerts = [[] for _ in buckets]
+            for alert in billion_alerts:
                 volume = alert['current_daily_volume']
-                if volume >= 1_000_000_000:  # 10亿USDT
-                    above_10b.append(alert)
-                elif volume >= 300_000_000:  # 3亿USDT
-                    between_3_10b.append(alert)
-                #elif volume >= 1_000_000_000:  # 10亿USDT (这个条件其实总是满足，因为billion_alerts已经是过亿的)
-                else:
-                    between_1_3b.append(alert)
+                for bucket_index, bucket in enumerate(buckets):
+                    if volume >= bucket[0]:
+                        grouped_alerts[bucket_index].append(alert)
+                        break
             
-            chart_urls = []
-            colors = [
-                '#FF6384', '#36A2EB', '#FFCE56', '#4BC0C0',
-                '#9966FF', '#FF9F40', '#FF6384', '#C9CBCF',
-                '#FF5733', '#33FF57', '#3357FF', '#FF33A1',
-                '#A133FF', '#33FFF5', '#F5FF33', '#FF8C33'
-            ]
+            chart_configs = []
+            colors = _BAR_CHART_COLORS
             
-            # 生成10亿以上的图表
-            if above_10b:
-                # 按成交额排序
-                above_10b.sort(key=lambda x: x['current_daily_volume'], reverse=True)
-                
-                labels = []
-                current_data = []
-                
-                for i, alert in enumerate(above_10b):
-                    inst_name = alert['inst_id'].replace('-SWAP', '').replace('-USDT', '')
-                    labels.append(inst_name)
-                    current_data.append(round(alert['current_daily_volume'] / 1_000_000_000, 2))  # 转换为十亿
-                
-                chart_config = {
-                    "type": "bar",
-                    "data": {
-                        "labels": labels,
-                        "datasets": [{
-                            "label": "当天成交额 (十亿USDT)",
-                            "data": current_data,
-                            "backgroundColor": [colors[i % len(colors)] for i in range(len(above_10b))],
-                            "borderColor": [colors[i % len(colors)] for i in range(len(above_10b))],
-                            "borderWidth": 1
-                        }]
-                    },
-                    "options": {
-                        "responsive": True,
-                        "maintainAspectRatio": False,
-                        "plugins": {
-                            "title": {
-                                "display": True,
-                                "text": "OKX 过亿成交额排行 - 10亿以上",
-                                "font": {
-                                    "size": 16,
-                                    "weight": "bold"
-                                }
-                            },
-                            "legend": {
-                                "display": True,
-                                "position": "top"
-                            }
-                        },
-                        "scales": {
-                            "y": {
-                                "beginAtZero": False,
-                                "title": {
-                                    "display": True,
-                                    "text": "成交额 (十亿USDT)"
-                                }
-                            },
-                            "x": {
-                                "title": {
-                                    "display": True,
-                                    "text": "交易对"
-                                }
-                            }
-                        }
-                    }
-                }
-                
-                chart_json = json.dumps(chart_config)
-                encoded_chart = urllib.parse.quote(chart_json)
-                chart_url = f"https://quickchart.io/chart?c={encoded_chart}&width=1200&height=400&format=png"
-                chart_urls.append(chart_url)
-            
-            # 生成3-10亿的图表
-            if between_3_10b:
-                # 按成交额排序
-                between_3_10b.sort(key=lambda x: x['current_daily_volume'], reverse=True)
-                
-                labels = []
-                current_data = []
-                
-                for i, alert in enumerate(between_3_10b):
-                    inst_name = alert['inst_id'].replace('-SWAP', '').replace('-USDT', '')
-                    labels.append(inst_name)
-                    current_data.append(round(alert['current_daily_volume'] / 100_000_000, 2))  # 转换为亿
-                
-                chart_config = {
-                    "type": "bar",
-                    "data": {
-                        "labels": labels,
-                        "datasets": [{
-                            "label": "当天成交额 (亿USDT)",
-                            "data": current_data,
-                            "backgroundColor": [colors[i % len(colors)] for i in range(len(between_3_10b))],
-                            "borderColor": [colors[i % len(colors)] for i in range(len(between_3_10b))],
-                            "borderWidth": 1
-                        }]
-                    },
-                    "options": {
-                        "responsive": True,
-                        "maintainAspectRatio": False,
-                        "plugins": {
-                            "title": {
-                                "display": True,
-                                "text": "OKX 过亿成交额排行 - 3-10亿区间",
-                                "font": {
-                                    "size": 16,
-                                    "weight": "bold"
-                                }
-                            },
-                            "legend": {
-                                "display": True,
-                                "position": "top"
-                            }
-                        },
-                        "scales": {
-                            "y": {
-                                "beginAtZero": False,
-                                "title": {
-                                    "display": True,
-                                    "text": "成交额 (亿USDT)"
-                                }
-                            },
-                            "x": {
-                                "title": {
-                                    "display": True,
-                                    "text": "交易对"
-                                }
-                            }
-                        }
-                    }
-                }
-                
-                chart_json = json.dumps(chart_config)
-                encoded_chart = urllib.parse.quote(chart_json)
-                chart_url = f"https://quickchart.io/chart?c={encoded_chart}&width=1200&height=400&format=png"
-                chart_urls.append(chart_url)
-            
-            # 生成1-3亿的图表
-            if between_1_3b:
-                # 按成交额排序
-                between_1_3b.sort(key=lambda x: x['current_daily_volume'], reverse=True)
-                
-                labels = []
-                current_data = []
+            for (_, divisor, decimals, unit, title_suffix), alerts in zip(buckets, grouped_alerts):
+                if not alerts:
+                    continue
                 
-                for i, alert in enumerate(between_1_3b):
-                    inst_name = alert['inst_id'].replace('-SWAP', '').replace('-USDT', '')
-                    labels.append(inst_name)
-                    current_data.append(round(alert['current_daily_volume'] / 10_000_000, 1))  # 转换为千万
+                # billion_alerts已按成交额排好序，分组时保持原有顺序，组内无需再排序
+                labels = [alert['inst_name'] for alert in alerts]
+                current_data = [round(alert['current_daily_volume'] / divisor, decimals) for alert in alerts]
+                bar_colors = [colors[i % len(colors)] for i in range(len(alerts))]
                 
                 chart_config = {
                     "type": "bar",
                     "data": {
                         "labels": labels,
                         "datasets": [{
-                            "label": "当天成交额 (千万USDT)",
+                            "label": f"当天成交额 ({unit})",
                             "data": current_data,
-                            "backgroundColor": [colors[i % len(colors)] for i in range(len(between_1_3b))],
-                            "borderColor": [colors[i % len(colors)] for i in range(len(between_1_3b))],
+                            "backgroundColor": bar_colors,
+                            "borderColor": bar_colors,
                             "borderWidth": 1
                         }]
                     },
@@ -576,7 +1080,7 @@ class OKXVolumeMonitor:
                         "plugins": {
                             "title": {
                                 "display": True,
-                                "text": "OKX 过亿成交额排行 - 1-3亿区间",
+                                "text": f"OKX 过亿成交额排行 - {title_suffix}",
                                 "font": {
                                     "size": 16,
                                     "weight": "bold"
@@ -592,7 +1096,7 @@ class OKXVolumeMonitor:
                                 "beginAtZero": False,
                                 "title": {
                                     "display": True,
-                                    "text": "成交额 (千万USDT)"
+                                    "text": f"成交额 ({unit})"
                                 }
                             },
                             "x": {
@@ -604,17 +1108,15 @@ class OKXVolumeMonitor:
                         }
                     }
                 }
-                
-                chart_json = json.dumps(chart_config)
-                encoded_chart = urllib.parse.quote(chart_json)
-                chart_url = f"https://quickchart.io/chart?c={encoded_chart}&width=1200&height=400&format=png"
-                chart_urls.append(chart_url)
+                chart_configs.append(chart_config)
             
-            print(f"[{self.get_current_time_str()}] 生成柱状图URL成功: 10亿以上 {len(above_10b)} 个，3-10亿 {len(between_3_10b)} 个，1-3亿 {len(between_1_3b)} 个")
+            chart_urls = self.build_chart_urls(chart_configs)
+            above_10b, between_3_10b, between_1_3b = grouped_alerts
+            logger.info(f"生成柱状图URL成功: 10亿以上 {len(above_10b)} 个，3-10亿 {len(between_3_10b)} 个，1-3亿 {len(between_1_3b)} 个")
             return chart_urls
             
         except Exception as e:
-            print(f"[{self.get_current_time_str()}] 生成图表URL时出错: {e}")
+            logger.error(f"生成图表URL时出错: {e}")
             return []
 
             
@@ -624,35 +1126,23 @@ class OKXVolumeMonitor:
             return []
         
         try:
-            # 过滤掉指定的交易对
-            filtered_alerts = []
-            for alert in billion_alerts:
-                inst_name = alert['inst_id'].replace('-SWAP', '').replace('-USDT', '')
-                if inst_name not in self.excluded_pairs:
-                    filtered_alerts.append(alert)
+            # 过滤掉指定的交易对（显示名称在生成警报时已计算好）
+            filtered_alerts = [alert for alert in billion_alerts if alert['inst_name'] not in self.excluded_pairs]
             
             if not filtered_alerts:
-                print(f"[{self.get_current_time_str()}] 过滤{'/'.join(self.excluded_pairs)}后，没有交易对可显示趋势图")
+                logger.info(f"过滤{'/'.join(self.excluded_pairs)}后，没有交易对可显示趋势图")
                 return []
             
-            # 获取所有可用的日期
-            all_dates = set()
-            for alert in filtered_alerts:
-                if alert['daily_volumes_history']:
-                    for vol_data in alert['daily_volumes_history']:
-                        all_dates.add(vol_data['date'])
-            
-            # 按日期排序 - 将此变量移到循环外部
-            sorted_dates = sorted(list(all_dates))[-7:]  # 最近7天
+            # 每个交易对的日期到成交额映射只构建一次（日期格式化也只做一次），所有日期直接取映射键的并集
+            volume_maps = [
+                dict(zip(self.format_history_dates(history), history['volume'].tolist()))
+                for history in (alert['daily_volumes_history'] for alert in filtered_alerts)
+            ]
+            sorted_dates = sorted(set().union(*volume_maps))[-7:]  # 最近7天
             
             # 按每N个币种分组（使用可配置的分组大小）
-            chart_urls = []
-            colors = [
-                '#FF6384', '#36A2EB', '#FFCE56', '#4BC0C0', '#9966FF',
-                '#FF9F40', '#FF6384', '#C9CBCF', '#FF5733', '#33FF57',
-                '#3357FF', '#FF33A1', '#A133FF', '#33FFF5', '#F5FF33',
-                '#FF8C33', '#8C33FF', '#33FF8C', '#FF3333', '#3333FF'
-            ]
+            chart_configs = []
+            colors = _TREND_CHART_COLORS
             
             # 每N个币种生成一个图表
             for group_index in range(0, len(filtered_alerts), self.chart_group_size):
@@ -661,19 +1151,11 @@ class OKXVolumeMonitor:
                 
                 # 为当前组的每个交易对准备数据
                 for i, alert in enumerate(group):
-                    inst_name = alert['inst_id'].replace('-SWAP', '').replace('-USDT', '')
-                    data = []
-                    
-                    # 创建日期到成交额的映射
-                    volume_map = {}
-                    if alert['daily_volumes_history']:
-                        for vol_data in alert['daily_volumes_history']:
-                            volume_map[vol_data['date']] = vol_data['volume']
+                    inst_name = alert['inst_name']
+                    volume_map = volume_maps[group_index + i]
                     
-                    # 按排序后的日期填充数据
-                    for date in sorted_dates:
-                        volume = volume_map.get(date, 0)
-                        data.append(round(volume / 1_000_000, 1))  # 转换为百万
+                    # 按排序后的日期填充数据，转换为百万
+                    data = [round(volume_map.get(date, 0) / 1_000_000, 1) for date in sorted_dates]
                     
                     datasets.append({
                         "label": inst_name,
@@ -740,113 +1222,110 @@ class OKXVolumeMonitor:
                     "pointHoverRadius": 0
                 })
                 
-                chart_json = json.dumps(chart_config)
-                encoded_chart = urllib.parse.quote(chart_json)
-                chart_url = f"https://quickchart.io/chart?c={encoded_chart}&width=1200&height=400&format=png"
-                chart_urls.append(chart_url)
+                chart_configs.append(chart_config)
             
+            chart_urls = self.build_chart_urls(chart_configs)
             excluded_pairs_text = '/'.join(self.excluded_pairs)
-            print(f"[{self.get_current_time_str()}] 生成{len(chart_urls)}个趋势图表URL，每{self.chart_group_size}个币种一组，总共包含 {len(filtered_alerts)} 个交易对（已排除{excluded_pairs_text}）")
+            logger.info(f"生成{len(chart_urls)}个趋势图表URL，每{self.chart_group_size}个币种一组，总共包含 {len(filtered_alerts)} 个交易对（已排除{excluded_pairs_text}）")
             return chart_urls
             
         except Exception as e:
-            print(f"[{self.get_current_time_str()}] 生成趋势图表URL时出错: {e}")
+            logger.error(f"生成趋势图表URL时出错: {e}")
             return []
    
     
     # 修改 create_billion_volume_table 方法，添加开关控制
     # 2. 修改 create_billion_volume_table 方法，添加涨跌幅列
-    def create_billion_volume_table(self, billion_alerts):
-        """创建过亿成交额的表格格式消息"""
-        if not billion_alerts:
+    def create_billion_volume_chart(self, billion_alerts):
+        """创建过亿成交额的图表部分（柱状图+趋势图），billion_alerts需已按交易额排序"""
+        parts = []
+        if not self.enable_bar_chart and not self.enable_trend_chart:
             return ""
         
-        # 按当天交易额从高到低排序
-        billion_alerts.sort(key=lambda x: x['current_daily_volume'], reverse=True)
-        
-        content = "## 💰 日成交过亿信号\n\n"
-        
         chart_urls = []
         trend_chart_urls = []
         
         if self.enable_bar_chart:
             chart_urls = self.generate_chart_url_quickchart(billion_alerts)
-            print(f"[{self.get_current_time_str()}] 柱状图开关已开启，生成柱状图")
+            logger.info(f"柱状图开关已开启，生成柱状图")
         else:
-            print(f"[{self.get_current_time_str()}] 柱状图开关已关闭，跳过柱状图生成")
+            logger.info(f"柱状图开关已关闭，跳过柱状图生成")
         
-           # 添加图表（只有在开关开启且生成成功时才添加）
+        # 添加图表（只有在开关开启且生成成功时才添加）
         if self.enable_bar_chart and chart_urls:
-            content += f"### 📊 成交额排行图\n"
-            for i, chart_url in enumerate(chart_urls):
-                if i == 0:
-                    content += f"![成交额排行-10亿以上]({chart_url})\n\n"
-                elif i == 1:
-                    content += f"![成交额排行-3到10亿]({chart_url})\n\n"
-                elif i == 2:
-                    content += f"![成交额排行-1到3亿]({chart_url})\n\n"
+            parts.append(f"### 📊 成交额排行图\n")
+            chart_titles = ("成交额排行-10亿以上", "成交额排行-3到10亿", "成交额排行-1到3亿")
+            for chart_title, chart_url in zip(chart_titles, chart_urls):
+                parts.append(f"![{chart_title}]({chart_url})\n\n")
         
         if self.enable_trend_chart:
             trend_chart_urls = self.generate_trend_chart_urls(billion_alerts)
-            print(f"[{self.get_current_time_str()}] 趋势图开关已开启，生成趋势图")
+            logger.info(f"趋势图开关已开启，生成趋势图")
         else:
-            print(f"[{self.get_current_time_str()}] 趋势图开关已关闭，跳过趋势图生成")
+            logger.info(f"趋势图开关已关闭，跳过趋势图生成")
         
         if self.enable_trend_chart and trend_chart_urls:
-            content += f"### 📈 成交额趋势图\n"
+            parts.append(f"### 📈 成交额趋势图\n")
             for i, trend_url in enumerate(trend_chart_urls):
-                content += f"![成交额趋势第{i+1}组]({trend_url})\n\n"
+                parts.append(f"![成交额趋势第{i+1}组]({trend_url})\n\n")
         
-        # 构建表头（添加涨跌幅列）
-        header = "### 📋 详细数据表格\n\n"
-        header += "| 交易对 | 当天成交额 | 24H涨跌幅 |"
-        separator = "|--------|------------|-----------|"
+        return "".join(parts)
+    
+    def create_billion_volume_table(self, billion_alerts):
+        """创建过亿成交额的表格格式消息"""
+        if not billion_alerts:
+            return ""
         
-        # 获取最多的历史天数
-        max_history_days = 0
-        for alert in billion_alerts:
-            if alert['daily_volumes_history']:
-                max_history_days = max(max_history_days, len(alert['daily_volumes_history']) - 1)
+        # 按当天交易额从高到低排序
+        billion_alerts = rank_alerts(billion_alerts, 'current_daily_volume')
+        
+        # 各部分先放入列表，最后一次拼接
+        parts = ["## 💰 日成交过亿信号\n\n"]
+        
+        # 图表部分（由柱状图/趋势图开关控制，都关闭时不生成任何图表）
+        parts.append(self.create_billion_volume_chart(billion_alerts))
         
-        # 添加历史日期的表头
-        for i in range(1, min(max_history_days + 1, 7)):
-            if billion_alerts[0]['daily_volumes_history'] and len(billion_alerts[0]['daily_volumes_history']) > i:
-                date = billion_alerts[0]['daily_volumes_history'][i]['date']
-                header += f" {date} |"
-                separator += "--------|"
+        # 历史列为下标1..history_columns-1（最多6天），按历史最长的交易对确定，一次遍历求出
+        max_history_len = max(len(alert['daily_volumes_history']) for alert in billion_alerts)
+        history_columns = min(max(max_history_len, 1), 7)
         
-        content += header + "\n"
-        content += separator + "\n"
+        # 构建表头（添加涨跌幅列），历史日期取第一个交易对的日期
+        date_columns = self.format_history_dates(billion_alerts[0]['daily_volumes_history'][1:history_columns])
+        parts.append("### 📋 详细数据表格\n\n")
+        parts.append("| 交易对 | 当天成交额 | 24H涨跌幅 |" + "".join(f" {date} |" for date in date_columns) + "\n")
+        parts.append("|--------|------------|-----------|" + "--------|" * len(date_columns) + "\n")
         
         # 填充数据（添加涨跌幅数据）
         for alert in billion_alerts:
             inst_id = alert['inst_id']
-            current_vol = self.format_volume(alert['current_daily_volume'])
-            price_change = alert.get('price_change_24h', 0)
+            current_vol = alert['current_vol_fmt']
+            price_change_str = format_price_change(alert.get('price_change_24h', 0))
             
-            # 格式化涨跌幅显示
-            if price_change > 0:
-                price_change_str = f"📈+{price_change:.2f}%"
-            elif price_change < 0:
-                price_change_str = f"📉{price_change:.2f}%"
-            else:
-                price_change_str = "➖0.00%"
-            
-            row = f"| {inst_id} | **{current_vol}** | {price_change_str} |"
-            
-            # 添加历史数据
-            history = alert['daily_volumes_history']
-            for i in range(1, min(max_history_days + 1, 7)):
-                if history and len(history) > i:
-                    hist_vol = self.format_volume(history[i]['volume'])
-                    row += f" {hist_vol} |"
-                else:
-                    row += " - |"
+            parts.append(f"| {inst_id} | **{current_vol}** | {price_change_str} |")
             
-            content += row + "\n"
+            # 添加历史数据（整行历史交易额一次批量格式化，不足的天数用"-"补齐）
+            history_fmt = format_volume_array(alert['daily_volumes_history']['volume'][1:history_columns])
+            parts.extend(f" {hist_vol} |" for hist_vol in history_fmt + ["-"] * (history_columns - 1 - len(history_fmt)))
+            parts.append("\n")
         
-        content += "\n"
-        return content
+        parts.append("\n")
+        return "".join(parts)
+    
+    def build_alert_row(self, alert):
+        """生成爆量表格的一行"""
+        # 过去3天的交易额数据已预先格式化，不足3天的用"-"补齐
+        day1, day2, day3 = (alert['past_3days_fmt'] + ["-", "-", "-"])[:3]
+        return _ALERT_ROW.format_map({
+            'inst_id': alert['inst_id'],
+            'current': alert['current_vol_fmt'],
+            'price_change': format_price_change(alert.get('price_change_24h', 0)),
+            'prev_ratio': f"{alert['prev_ratio']:.1f}x 📈" if alert['prev_ratio'] else "-",
+            'ma10_ratio': f"{alert['ma10_ratio']:.1f}x 📈" if alert['ma10_ratio'] else "-",
+            'daily': alert['daily_vol_fmt'],
+            'day1': day1,
+            'day2': day2,
+            'day3': day3
+        })
     
     # 3. 修改 create_alert_table 方法，添加涨跌幅列
     def create_alert_table(self, alerts):
@@ -854,81 +1333,20 @@ class OKXVolumeMonitor:
         if not alerts:
             return ""
         
-        # 按时间框架分组
-        hour_alerts = [alert for alert in alerts if alert['timeframe'] == '1H']
-        four_hour_alerts = [alert for alert in alerts if alert['timeframe'] == '4H']
+        # 所有警报按当前交易额从高到低一次排序，再按时间框架分组（分组保持排序后的顺序）
+        ranked_alerts = rank_alerts(alerts, 'current_volume')
+        hour_alerts = [alert for alert in ranked_alerts if alert['timeframe'] == '1H']
+        four_hour_alerts = [alert for alert in ranked_alerts if alert['timeframe'] == '4H']
         
-        # 按当前交易额从高到低排序
-        hour_alerts.sort(key=lambda x: x['current_volume'], reverse=True)
-        four_hour_alerts.sort(key=lambda x: x['current_volume'], reverse=True)
-        
-        content = ""
-        
-        if hour_alerts:
-            content += "## 🔥 1小时爆量信号\n\n"
-            content += "| 交易对 | 当前交易额 | 24H涨跌幅 | 相比上期 | 相比MA10 | 当天总额 | 昨天 | 前天 | 3天前 |\n"
-            content += "|--------|------------|-----------|----------|----------|----------|------|------|------|\n"
-            
-            for alert in hour_alerts:
-                inst_id = alert['inst_id']
-                current_vol = self.format_volume(alert['current_volume'])
-                daily_vol = self.format_volume(alert['daily_volume'])
-                price_change = alert.get('price_change_24h', 0)
-                
-                # 格式化涨跌幅显示
-                if price_change > 0:
-                    price_change_str = f"📈+{price_change:.2f}%"
-                elif price_change < 0:
-                    price_change_str = f"📉{price_change:.2f}%"
-                else:
-                    price_change_str = "➖0.00%"
-                
-                prev_ratio_str = f"{alert['prev_ratio']:.1f}x 📈" if alert['prev_ratio'] else "-"
-                ma10_ratio_str = f"{alert['ma10_ratio']:.1f}x 📈" if alert['ma10_ratio'] else "-"
-                
-                # 获取过去3天的交易额数据
-                past_volumes = alert.get('past_3days_volumes', [])
-                day1_vol = self.format_volume(past_volumes[0]['volume']) if len(past_volumes) > 0 else "-"
-                day2_vol = self.format_volume(past_volumes[1]['volume']) if len(past_volumes) > 1 else "-"
-                day3_vol = self.format_volume(past_volumes[2]['volume']) if len(past_volumes) > 2 else "-"
-                
-                content += f"| {inst_id} | {current_vol} | {price_change_str} | {prev_ratio_str} | {ma10_ratio_str} | {daily_vol} | {day1_vol} | {day2_vol} | {day3_vol} |\n"
-            
-            content += "\n"
-        
-        if four_hour_alerts:
-            content += "## 🚀 4小时爆量信号\n\n"
-            content += "| 交易对 | 当前交易额 | 24H涨跌幅 | 相比上期 | 相比MA10 | 当天总额 | 昨天 | 前天 | 3天前 |\n"
-            content += "|--------|------------|-----------|----------|----------|----------|------|------|------|\n"
-            
-            for alert in four_hour_alerts:
-                inst_id = alert['inst_id']
-                current_vol = self.format_volume(alert['current_volume'])
-                daily_vol = self.format_volume(alert['daily_volume'])
-                price_change = alert.get('price_change_24h', 0)
-                
-                # 格式化涨跌幅显示
-                if price_change > 0:
-                    price_change_str = f"📈+{price_change:.2f}%"
-                elif price_change < 0:
-                    price_change_str = f"📉{price_change:.2f}%"
-                else:
-                    price_change_str = "➖0.00%"
-                
-                prev_ratio_str = f"{alert['prev_ratio']:.1f}x 📈" if alert['prev_ratio'] else "-"
-                ma10_ratio_str = f"{alert['ma10_ratio']:.1f}x 📈" if alert['ma10_ratio'] else "-"
-                
-                # 获取过去3天的交易额数据
-                past_volumes = alert.get('past_3days_volumes', [])
-                day1_vol = self.format_volume(past_volumes[0]['volume']) if len(past_volumes) > 0 else "-"
-                day2_vol = self.format_volume(past_volumes[1]['volume']) if len(past_volumes) > 1 else "-"
-                day3_vol = self.format_volume(past_volumes[2]['volume']) if len(past_volumes) > 2 else "-"
-                
-                content += f"| {inst_id} | {current_vol} | {price_change_str} | {prev_ratio_str} | {ma10_ratio_str} | {daily_vol} | {day1_vol} | {day2_vol} | {day3_vol} |\n"
-            
-            content += "\n"
+        parts = []
+        for title, section_alerts in (("## 🔥 1小时爆量信号", hour_alerts), ("## 🚀 4小时爆量信号", four_hour_alerts)):
+            if not section_alerts:
+                continue
+            parts.append(f"{title}\n\n{_ALERT_TABLE_HEADER}")
+            parts.extend(self.build_alert_row(alert) for alert in section_alerts)
+            parts.append("\n")
         
-        return content
+        return "".join(parts)
     
     # 4. 修改 send_heartbeat_notification 方法，添加新开关状态显示
     def send_heartbeat_notification(self, monitored_count):
@@ -936,69 +1354,70 @@ class OKXVolumeMonitor:
         current_time = self.get_current_time_str()
         last_alert_time = self.get_last_alert_time()
         
+        title = "OKX监控系统心跳 💓"
+        parts = [
+            "监控系统正常运行中...\n\n",
+            "📊 监控状态: 正常\n",
+            f"📈 监控交易对: {monitored_count} 个\n",
+            f"⏰ 检查时间: {current_time}\n"
+        ]
+        
         if last_alert_time > 0:
-            last_alert_datetime = datetime.fromtimestamp(last_alert_time, self.timezone)
-            time_since_alert = datetime.now(self.timezone) - last_alert_datetime
-            hours_since = int(time_since_alert.total_seconds() / 3600)
-            
-            title = "OKX监控系统心跳 💓"
-            content = f"监控系统正常运行中...\n\n"
-            content += f"📊 监控状态: 正常\n"
-            content += f"📈 监控交易对: {monitored_count} 个\n"
-            content += f"⏰ 检查时间: {current_time}\n"
-            content += f"🔕 距离上次爆量警报: {hours_since} 小时\n"
-            content += f"📅 上次警报时间: {last_alert_datetime.strftime('%Y-%m-%d %H:%M:%S')}\n"
-            
-            # 添加配置信息
-            content += f"⚙️ 爆量开关: {'开启' if self.enable_volume_alerts else '关闭'}\n"
-            if self.enable_volume_alerts:
-                content += f"📊 爆量阈值: {self.format_volume(self.volume_alert_daily_threshold)}\n"
-            content += f"💰 过亿新增判断: {'开启' if self.enable_billion_new_only else '关闭'}\n"
-            content += f"📈 图表配置: 柱状图{'✅' if self.enable_bar_chart else '❌'} 趋势图{'✅' if self.enable_trend_chart else '❌'}\n\n"
-            content += f"💡 提示: 已连续 {hours_since} 小时无爆量信号"
+            # 直接用时间戳相减计算间隔，只在展示时格式化一次
+            hours_since = int((time.time() - last_alert_time) / 3600)
+            last_alert_time_str = datetime.fromtimestamp(last_alert_time, self.timezone).strftime('%Y-%m-%d %H:%M:%S')
+            parts.append(f"🔕 距离上次爆量警报: {hours_since} 小时\n")
+            parts.append(f"📅 上次警报时间: {last_alert_time_str}\n")
+            tip = f"💡 提示: 已连续 {hours_since} 小时无爆量信号"
         else:
-            title = "OKX监控系统心跳 💓"
-            content = f"监控系统正常运行中...\n\n"
-            content += f"📊 监控状态: 正常\n"
-            content += f"📈 监控交易对: {monitored_count} 个\n"
-            content += f"⏰ 检查时间: {current_time}\n"
-            content += f"🔕 暂无爆量警报记录\n"
-            
-            # 添加配置信息
-            content += f"⚙️ 爆量开关: {'开启' if self.enable_volume_alerts else '关闭'}\n"
-            if self.enable_volume_alerts:
-                content += f"📊 爆量阈值: {self.format_volume(self.volume_alert_daily_threshold)}\n"
-            content += f"💰 过亿新增判断: {'开启' if self.enable_billion_new_only else '关闭'}\n"
-            content += f"📈 图表配置: 柱状图{'✅' if self.enable_bar_chart else '❌'} 趋势图{'✅' if self.enable_trend_chart else '❌'}\n\n"
-            content += f"💡 提示: 系统首次运行或记录文件不存在"
+            parts.append("🔕 暂无爆量警报记录\n")
+            tip = "💡 提示: 系统首次运行或记录文件不存在"
+        
+        # 添加配置信息
+        parts.append(f"⚙️ 爆量开关: {'开启' if self.enable_volume_alerts else '关闭'}\n")
+        if self.enable_volume_alerts:
+            parts.append(f"📊 爆量阈值: {self.format_volume(self.volume_alert_daily_threshold)}\n")
+        parts.append(f"💰 过亿新增判断: {'开启' if self.enable_billion_new_only else '关闭'}\n")
+        parts.append(f"📈 图表配置: 柱状图{'✅' if self.enable_bar_chart else '❌'} 趋势图{'✅' if self.enable_trend_chart else '❌'}\n\n")
+        parts.append(tip)
+        content = "".join(parts)
         
         success = self.send_notification(title, content)
         if success:
-            print(f"[{self.get_current_time_str()}] 心跳消息发送成功")
+            logger.info(f"心跳消息发送成功")
         return success
     
     def send_notification(self, title, content):
         """通过Server酱发送微信通知"""
         try:
-            url = f"https://sctapi.ftqq.com/{self.server_jiang_key}.send"
+            url = self.notification_url
             data = {
                 'title': title,
                 'desp': content
             }
             
-            response = requests.post(url, data=data, timeout=30)
+            if self.enable_gzip_notification:
+                # 先按表单格式编码，再整体gzip压缩
+                body = gzip.compress(urllib.parse.urlencode(data).encode('utf-8'))
+                headers = {
+                    'Content-Type': 'application/x-www-form-urlencoded',
+                    'Content-Encoding': 'gzip'
+                }
+                response = self.get_http_session().post(url, data=body, headers=headers, timeout=30)
+            else:
+                response = self.get_http_session().post(url, data=data, timeout=30)
             response.raise_for_status()
             
-            result = response.json()
+            result = orjson.loads(response.content)
             if result.get('code') == 0:
-                print(f"[{self.get_current_time_str()}] 通知发送成功: {title}")
+                logger.info(f"通知发送成功: {title}")
                 return True
             else:
-                print(f"[{self.get_current_time_str()}] 通知发送失败: {result}")
+                logger.error(f"通知发送失败: {result}")
                 return False
                 
         except Exception as e:
-            print(f"[{self.get_current_time_str()}] 发送通知时出错: {e}")
+            logger.error(f"发送通知时出错: {e}")
             return False
     
      
@@ -1006,32 +1425,32 @@ class OKXVolumeMonitor:
         """获取上次过亿成交的交易对列表"""
         try:
             if os.path.exists(self.last_billion_pairs_file):
-                with open(self.last_billion_pairs_file, 'r') as f:
+                with open(self.last_billion_pairs_file, 'rb') as f:
                     pairs_json = f.read().strip()
                     if pairs_json:
-                        return json.loads(pairs_json)
+                        return orjson.loads(pairs_json)
             return []
         except Exception as e:
-            print(f"[{self.get_current_time_str()}] 读取上次过亿交易对失败: {e}")
+            logger.error(f"读取上次过亿交易对失败: {e}")
             return []
     
     def update_last_billion_pairs(self, billion_alerts):
-        """更新上次过亿成交的交易对列表"""
+        """更新上次过亿成交的交易对列表（先写临时文件再替换，中途失败不会留下半个文件）"""
         try:
-            pairs = [alert['inst_id'] for alert in billion_alerts]
-            pairs.sort()  # 排序以便比较
-            with open(self.last_billion_pairs_file, 'w') as f:
-                f.write(json.dumps(pairs))
+            pairs = sorted(alert['inst_id'] for alert in billion_alerts)  # 排序以便比较
+            tmp_file = f"{self.last_billion_pairs_file}.tmp"
+            with open(tmp_file, 'wb') as f:
+                f.write(orjson.dumps(pairs))
+            os.replace(tmp_file, self.last_billion_pairs_file)
         except Exception as e:
-            print(f"[{self.get_current_time_str()}] 更新上次过亿交易对失败: {e}")
+            logger.error(f"更新上次过亿交易对失败: {e}")
     
     def is_billion_pairs_same_as_last(self, current_billion_alerts):
         """检查当前过亿交易对是否与上次完全相同"""
         if not current_billion_alerts:
             return False
         
-        current_pairs = [alert['inst_id'] for alert in current_billion_alerts]
-        current_pairs.sort()
+        current_pairs = sorted(alert['inst_id'] for alert in current_billion_alerts)
         
         last_pairs = self.get_last_billion_pairs()
         
@@ -1053,58 +1472,69 @@ class OKXVolumeMonitor:
         if new_pairs:
             # 转换为币种名称（去掉-SWAP后缀）
             new_coin_names = [pair.replace('-SWAP', '').replace('-USDT', '') for pair in new_pairs]
-            print(f"[{self.get_current_time_str()}] 发现新增过亿币种: {', '.join(new_pairs)}")
+            logger.info(f"发现新增过亿币种: {', '.join(new_pairs)}")
             return True, new_coin_names
         else:
-            print(f"[{self.get_current_time_str()}] 过亿币种无新增")
+            logger.info(f"过亿币种无新增")
             return False, []
     
 
-    def run_monitor(self):
-        """运行监控主程序（修改版本）"""
-        print(f"[{self.get_current_time_str()}] 开始监控")
-        print(f"[{self.get_current_time_str()}] 爆量信息开关: {'开启' if self.enable_volume_alerts else '关闭'}")
-        if self.enable_volume_alerts:
-            print(f"[{self.get_current_time_str()}] 爆量信息当天成交额阈值: {self.format_volume(self.volume_alert_daily_threshold)}")
-        # 新增：显示过亿新增判断开关状态
-        print(f"[{self.get_current_time_str()}] 过亿新增判断开关: {'开启' if self.enable_billion_new_only else '关闭'}")
-    
-        # 获取交易对列表
-        instruments = self.get_perpetual_instruments()
-        if not instruments:
-            print(f"[{self.get_current_time_str()}] 未能获取交易对列表，退出监控")
-            return
-        
-        # 监控所有活跃的交易对，分批处理
-        batch_size = 30
-        total_batches = (len(instruments) + batch_size - 1) // batch_size
-        print(f"[{self.get_current_time_str()}] 开始监控所有 {len(instruments)} 个交易对，分 {total_batches} 批处理")
-        
+    async def scan_market(self):
+        """获取交易对列表并并发扫描，整个过程共用一个aiohttp会话"""
         all_alerts = []
         all_billion_alerts = []
         
-        # 分批处理交易对
-        for batch_num in range(0, len(instruments), batch_size):
-            batch = instruments[batch_num:batch_num + batch_size]
-            batch_index = batch_num // batch_size + 1
-            
-            print(f"[{self.get_current_time_str()}] 处理第 {batch_index}/{total_batches} 批 ({len(batch)} 个交易对)")
-            
+        self._request_semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+        self._next_request_time = 0
+        self._last_slow_down_time = None
+        self._rate_success_streak = 0
+        self.requests_per_second = self.load_request_rate()
+        if self.requests_per_second < self.max_requests_per_second:
+            logger.info(f"上次运行遇到过429，本次从每秒{self.requests_per_second:g}次开始")
+        connector = aiohttp.TCPConnector(
+            limit=self.max_concurrent_requests * 2,
+            limit_per_host=self.max_concurrent_requests * 2,
+            keepalive_timeout=60,  # 扫描期间保持长连接，避免反复握手
+            ttl_dns_cache=300,
+            enable_cleanup_closed=True  # 及时回收服务端异常断开的SSL连接
+        )
+        async with aiohttp.ClientSession(
+            headers=self.request_headers,
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.request_timeout)
+        ) as session:
+            self.session = session
             try:
-                batch_alerts, batch_billion_alerts = self.check_volume_explosion_batch(batch)
-                all_alerts.extend(batch_alerts)
-                all_billion_alerts.extend(batch_billion_alerts)
+                # 获取交易对列表
+                instruments = await self.get_perpetual_instruments()
+                if not instruments:
+                    logger.info(f"未能获取交易对列表，退出监控")
+                    return [], all_alerts, all_billion_alerts, None
                 
-                # 批次间添加更长延迟2秒
-                if batch_index < total_batches:
-                    print(f"[{self.get_current_time_str()}] 批次间等待2秒...")
-                    time.sleep(2)
-                    
-            except Exception as e:
-                print(f"[{self.get_current_time_str()}] 处理第 {batch_index} 批时出错: {e}")
-                continue
+                # 监控所有活跃的交易对：一次性并发提交，由_request_semaphore和请求限速控制节奏，不再分批等待
+                scan_instruments = instruments
+                if self.enable_ticker_prefilter:
+                    scan_instruments = await self.prefilter_instruments(instruments)
+                logger.info(f"开始监控 {len(scan_instruments)} 个交易对")
+                all_alerts, all_billion_alerts = await self.check_volume_explosion_batch(scan_instruments)
+                
+                # 先决定推送内容，再在会话关闭前只为确定要推送（且不是重复推送）的警报获取日交易额历史：
+                # 安静的运行中BTC/ETH等常驻过亿交易对不再各多请求一次日K线
+                plan = self.plan_notification(all_alerts, all_billion_alerts)
+                if plan is not None and not plan['duplicate']:
+                    await self.attach_daily_histories(all_alerts, all_billion_alerts if plan['send_billion'] else [])
+            finally:
+                self.session = None
+                self.save_request_rate()
+                self.flush_cached_klines()
         
-       # 检查是否需要发送通知
+        return instruments, all_alerts, all_billion_alerts, plan
+
+    def plan_notification(self, all_alerts, all_billion_alerts):
+        """根据扫描结果决定本次要推送的内容（是否带过亿信息、标题、是否与上次推送重复）
+
+        没有需要推送的信号时返回None；在扫描会话关闭前调用，只为确定要推送的警报补充日交易额历史
+        """
         has_volume_alerts = len(all_alerts) > 0
         has_billion_alerts = len(all_billion_alerts) > 0
         
@@ -1121,9 +1551,9 @@ class OKXVolumeMonitor:
                 # 修改：如果有爆量信息，不管是否有新增都输出过亿信息
                 if has_volume_alerts:
                     should_send_billion_alert = True
-                    print(f"[{self.get_current_time_str()}] 因有爆量信息，强制输出过亿信息（新增判断：{'有' if has_new_billion else '无'}新增）")
+                    logger.info(f"因有爆量信息，强制输出过亿信息（新增判断：{'有' if has_new_billion else '无'}新增）")
                 elif not should_send_billion_alert:
-                    print(f"[{self.get_current_time_str()}] 过亿币种无新增，跳过发送过亿信号")
+                    logger.info(f"过亿币种无新增，跳过发送过亿信号")
             else:
                 # 关闭新增判断：只要与上次不完全相同就发送（原有逻辑）
                 should_send_billion_alert = not self.is_billion_pairs_same_as_last(all_billion_alerts)
@@ -1131,131 +1561,174 @@ class OKXVolumeMonitor:
                 has_new_billion, new_billion_coins = self.has_new_billion_pairs(all_billion_alerts)
                 if not should_send_billion_alert:
                     current_pairs = [alert['inst_id'] for alert in all_billion_alerts]
-                    print(f"[{self.get_current_time_str()}] 过亿交易对与上次完全相同 ({', '.join(current_pairs)})，跳过发送")
-        
-        # 发送汇总通知
-        has_any_signal = has_volume_alerts or should_send_billion_alert
-        
-        if has_any_signal:
-            # 筛选符合条件的币种（1小时爆量超过1000万或4小时爆量超过2000万）
-            high_volume_coins = []
-            for alert in all_alerts:
-                inst_name = alert['inst_id'].replace('-SWAP', '').replace('-USDT', '')
-                current_volume = alert['current_volume']
-                timeframe = alert['timeframe']
-                
-                # 检查是否符合条件
-                if (timeframe == '1H' and current_volume >= 10_000_000) or \
-                   (timeframe == '4H' and current_volume >= 20_000_000):
-                    if inst_name not in high_volume_coins:
-                        high_volume_coins.append(inst_name)
+                    logger.info(f"过亿交易对与上次完全相同 ({', '.join(current_pairs)})，跳过发送")
+        
+        if not (has_volume_alerts or should_send_billion_alert):
+            return None
+        
+        # 筛选符合条件的币种（1小时爆量超过1000万或4小时爆量超过2000万）
+        high_volume_coins = []
+        for alert in all_alerts:
+            inst_name = alert['inst_name']
+            current_volume = alert['current_volume']
+            timeframe = alert['timeframe']
             
-            # 构建标题
-            if has_volume_alerts and should_send_billion_alert:
-                base_title = f"🚨 OKX监控 - {len(all_alerts)}个爆量+{len(all_billion_alerts)}个过亿"
-                if high_volume_coins:
-                    title = f"{base_title} ({'/'.join(high_volume_coins)})"
-                else:
-                    title = base_title
-                # 如果有新增过亿币种，添加到标题中
-                if has_new_billion and new_billion_coins:
-                    title += f" 新增:{'/'.join(new_billion_coins)}"
-                elif has_billion_alerts:
-                    title += " (无新增)"
-            elif has_volume_alerts:
-                base_title = f"🚨 OKX监控 - 发现{len(all_alerts)}个爆量信号"
-                if high_volume_coins:
-                    title = f"{base_title} ({'/'.join(high_volume_coins)})"
-                else:
-                    title = base_title
+            # 检查是否符合条件
+            if (timeframe == '1H' and current_volume >= 10_000_000) or \
+               (timeframe == '4H' and current_volume >= 20_000_000):
+                if inst_name not in high_volume_coins:
+                    high_volume_coins.append(inst_name)
+        
+        # 构建标题
+        if has_volume_alerts and should_send_billion_alert:
+            base_title = f"🚨 OKX监控 - {len(all_alerts)}个爆量+{len(all_billion_alerts)}个过亿"
+            if high_volume_coins:
+                title = f"{base_title} ({'/'.join(high_volume_coins)})"
             else:
-                base_title = f"💰 OKX监控 - 发现{len(all_billion_alerts)}个过亿信号"
-                # 如果有新增过亿币种，添加到标题中
-                if has_new_billion and new_billion_coins:
-                    title = f"{base_title} 新增:{'/'.join(new_billion_coins)}"
-                else:
-                    title = base_title
-                
-            content = f"**监控时间**: {self.get_current_time_str()}\n"
-            content += f"**监控范围**: {len(instruments)} 个交易对\n\n"
+                title = base_title
+            # 如果有新增过亿币种，添加到标题中
+            if has_new_billion and new_billion_coins:
+                title += f" 新增:{'/'.join(new_billion_coins)}"
+            elif has_billion_alerts:
+                title += " (无新增)"
+        elif has_volume_alerts:
+            base_title = f"🚨 OKX监控 - 发现{len(all_alerts)}个爆量信号"
+            if high_volume_coins:
+                title = f"{base_title} ({'/'.join(high_volume_coins)})"
+            else:
+                title = base_title
+        else:
+            base_title = f"💰 OKX监控 - 发现{len(all_billion_alerts)}个过亿信号"
+            # 如果有新增过亿币种，添加到标题中
+            if has_new_billion and new_billion_coins:
+                title = f"{base_title} 新增:{'/'.join(new_billion_coins)}"
+            else:
+                title = base_title
+        
+        # 与最近一次推送的警报集合完全相同时不再重复推送（也省去生成图表的请求）
+        billion_for_digest = all_billion_alerts if should_send_billion_alert else []
+        alert_digest = self.get_alert_digest(title, all_alerts, billion_for_digest)
+        duplicate = self.is_duplicate_alert(alert_digest)
+        if duplicate:
+            logger.info(f"警报内容与{self.duplicate_alert_window // 60}分钟内的上次推送相同，跳过发送: {title}")
+        
+        return {
+            'title': title,
+            'send_billion': should_send_billion_alert,
+            'has_new_billion': has_new_billion,
+            'digest': alert_digest,
+            'duplicate': duplicate
+        }
+
+    def run_monitor(self):
+        """运行监控主程序（修改版本）"""
+        logger.info(f"开始监控")
+        logger.info(f"爆量信息开关: {'开启' if self.enable_volume_alerts else '关闭'}")
+        if self.enable_volume_alerts:
+            logger.info(f"爆量信息当天成交额阈值: {self.format_volume(self.volume_alert_daily_threshold)}")
+        # 新增：显示过亿新增判断开关状态
+        logger.info(f"过亿新增判断开关: {'开启' if self.enable_billion_new_only else '关闭'}")
+    
+        # 获取交易对列表并扫描（异步）
+        instruments, all_alerts, all_billion_alerts, plan = asyncio.run(self.scan_market())
+        if not instruments:
+            return
+        
+        # 推送计划（是否带过亿信息、标题、是否重复）已在扫描中由plan_notification确定
+        if plan is not None and plan['duplicate']:
+            logger.info(f"监控完成")
+            return
+        
+        notified_at = None  # 警报或心跳发送成功的时间，在最后统一写入一次上次警报时间
+        
+        if plan is not None:
+            has_volume_alerts = len(all_alerts) > 0
+            has_billion_alerts = len(all_billion_alerts) > 0
+            should_send_billion_alert = plan['send_billion']
+            has_new_billion = plan['has_new_billion']
+            title = plan['title']
+            
+            # 消息正文各段先放入列表，最后一次性拼接
+            parts = [
+                f"**监控时间**: {self.get_current_time_str()}\n",
+                f"**监控范围**: {len(instruments)} 个交易对\n\n"
+            ]
             
             # 先创建爆量表格
             if all_alerts:
-                table_content = self.create_alert_table(all_alerts)
-                content += table_content
+                parts.append(self.create_alert_table(all_alerts))
             
             # 再创建过亿成交额表格（只有在should_send_billion_alert为True时才添加）
             if should_send_billion_alert:
+                billion_table_content = self.create_billion_volume_table(all_billion_alerts)
                 # 添加过亿信息标题，标注是否有新增
                 if has_volume_alerts and has_billion_alerts:
                     if has_new_billion:
                         billion_title = "## 💰 过亿信息（有新增）\n"
                     else:
                         billion_title = "## 💰 过亿信息（无新增）\n"
-                    # 在过亿表格前添加标题
-                    billion_table_content = self.create_billion_volume_table(all_billion_alerts)
                     # 替换原有的标题
                     billion_table_content = billion_table_content.replace("## 💰 日成交过亿信号\n\n", billion_title)
-                    content += billion_table_content
-                else:
-                    billion_table_content = self.create_billion_volume_table(all_billion_alerts)
-                    content += billion_table_content
+                parts.append(billion_table_content)
             
-            # 添加说明（根据开关状态调整说明内容）
-            content += "---\n\n"
-            content += "**说明**:\n"
-            content += "- **爆量信号**: 1H需10倍增长，4H需5倍增长\n"
+            # 添加说明（根据开关状态调整说明内容，固定不变的部分使用模块级常量）
+            parts.append(_LEGEND_HEADER)
             # 添加阈值说明
             if self.enable_volume_alerts:
-                content += f"- **爆量阈值**: 当天成交额需超过{self.format_volume(self.volume_alert_daily_threshold)}\n"
+                parts.append(f"- **爆量阈值**: 当天成交额需超过{self.format_volume(self.volume_alert_daily_threshold)}\n")
             else:
-                content += "- **爆量信息**: 已关闭\n"
+                parts.append("- **爆量信息**: 已关闭\n")
             
-            content += "- **过亿信号**: 当天成交额超过1亿USDT\n"
-            content += "- **过亿信号**: 当天成交额超过1亿USDT\n"
-            content += "- **相比上期**: 与上一个同周期的交易额对比\n"
-            content += "- **相比MA10**: 与过去10个周期平均值对比\n"
-            content += "- **当前交易额**: 1H为最新1小时K线volCcyQuote，4H为最新4小时K线volCcyQuote\n"
-            content += "- **当天总额**: 24小时内所有1小时K线volCcyQuote字段之和\n"
-            content += "- **K/M/B**: 千/百万/十亿 USDT\n"
+            parts.append(_LEGEND_FIELD_NOTES)
             
             # 根据开关状态添加图表说明
             if self.enable_bar_chart or self.enable_trend_chart:
-                content += "- **图表**: 由QuickChart.io生成"
+                parts.append("- **图表**: 由QuickChart.io生成")
                 if self.enable_bar_chart and self.enable_trend_chart:
-                    content += "，包含排行图和趋势对比图\n"
+                    parts.append("，包含排行图和趋势对比图\n")
                 elif self.enable_bar_chart:
-                    content += "，仅显示排行图\n"
+                    parts.append("，仅显示排行图\n")
                 elif self.enable_trend_chart:
-                    content += "，仅显示趋势对比图\n"
+                    parts.append("，仅显示趋势对比图\n")
                 
                 if self.enable_trend_chart:
-                    content += "- **趋势图**: 已排除BTC和ETH交易对，专注于其他币种\n"
+                    parts.append("- **趋势图**: 已排除BTC和ETH交易对，专注于其他币种\n")
             else:
-                content += "- **图表**: 已关闭图表功能\n"
+                parts.append("- **图表**: 已关闭图表功能\n")
             
-            content += f"- **图表配置**: 柱状图{'✅' if self.enable_bar_chart else '❌'} 趋势图{'✅' if self.enable_trend_chart else '❌'}"
+            parts.append(f"- **图表配置**: 柱状图{'✅' if self.enable_bar_chart else '❌'} 趋势图{'✅' if self.enable_trend_chart else '❌'}")
+            content = "".join(parts)
             
             success = self.send_notification(title, content)
             if success:
-                # 更新上次发送爆量警报的时间
-                self.update_last_alert_time()
+                notified_at = time.time()
+                self.update_last_alert_digest(plan['digest'], notified_at)
                 # 如果发送了过亿信号，更新上次过亿交易对记录
                 if should_send_billion_alert:
                     self.update_last_billion_pairs(all_billion_alerts)
         else:
-            print(f"[{self.get_current_time_str()}] 未发现需要发送的信号")
+            logger.info(f"未发现需要发送的信号")
             
             # 检查是否需要发送心跳消息
             if self.should_send_heartbeat():
-                print(f"[{self.get_current_time_str()}] 距离上次爆量警报已超过4小时，发送心跳消息")
+                logger.info(f"距离上次爆量警报已超过4小时，发送心跳消息")
                 heartbeat_success = self.send_heartbeat_notification(len(instruments))
                 if heartbeat_success:
-                    # 更新心跳时间（避免频繁发送心跳）
-                    self.update_last_alert_time()
+                    # 心跳同样计入上次警报时间（避免频繁发送心跳）
+                    notified_at = time.time()
         
-        print(f"[{self.get_current_time_str()}] 监控完成")
+        if notified_at is not None:
+            self.update_last_alert_time(notified_at)
+        
+        logger.info(f"监控完成")
         
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='OKX永续合约爆量监控')
+    parser.add_argument('--refresh-instruments', action='store_true',
+                        help='忽略本地缓存，强制重新获取交易对列表')
+    args = parser.parse_args()
+    
+    setup_logging()
     monitor = OKXVolumeMonitor()
+    monitor.refresh_instruments = args.refresh_instruments
     monitor.run_monitor()